@@ -0,0 +1,279 @@
+''' Measures how fast the engine and the monsters run, on a fixed set of
+    scenarios, so that changes to them can be compared. Each scenario runs in
+    a process of its own and reports the world load time, behaviour turns per
+    second, the median and 99th percentile time of a behaviour() call and the
+    peak memory of the process.
+
+    Examples:
+
+      python benchmark.py --list
+      python benchmark.py --output baseline.json
+      python benchmark.py small water --repeat 3 --baseline baseline.json
+'''
+
+import argparse, json, multiprocessing, os, platform, random, shutil, sys, tempfile, time
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows, where peak memory is not reported
+  resource = None
+
+from monsters import World, Monster
+from tournament import loadMonsterClass
+import worldfile
+
+class RandomWalker(Monster):
+  ''' Eats what it finds and otherwise wanders about, costing next to nothing
+      to decide, so scenarios full of them measure the engine itself '''
+
+  def behaviour(self):
+    if self.isOnFruit():
+      self.eatFruit()
+
+    self.moveRandomly()
+
+# Each scenario has a world, either a world file or a map generated as
+# (width, height) and optionally compiled first, the number of monsters of
+# each class, and the number of ticks to run
+scenarios = [
+  {'name' : 'small', 'world' : 'worlds/1.world', 'ticks' : 6000,
+   'monsters' : [('monsters:DefaultMonster', 2), ('bender:Bender', 1), ('benchmark:RandomWalker', 1)]},
+  {'name' : 'water', 'world' : 'worlds/water.world', 'ticks' : 6000,
+   'monsters' : [('monsters:DefaultMonster', 8), ('bender:Bender', 4), ('benchmark:RandomWalker', 4)]},
+  {'name' : 'large', 'world' : (128, 128), 'ticks' : 2000,
+   'monsters' : [('monsters:DefaultMonster', 80), ('bender:Bender', 4), ('benchmark:RandomWalker', 16)]},
+  {'name' : 'crowd', 'world' : (256, 256), 'compiled' : True, 'ticks' : 1000,
+   'monsters' : [('monsters:DefaultMonster', 800), ('bender:Bender', 2), ('benchmark:RandomWalker', 198)]},
+]
+
+# Measurements of a scenario, and whether higher values are better
+metrics = [('loadSeconds', False), ('turnsPerSecond', True), ('p50Microseconds', False),
+           ('p99Microseconds', False), ('peakMemoryMB', False)]
+
+def generateWorld(width, height, seed, filename):
+  ''' Writes a text world file with a rock border, scattered rocks and
+      patches of pond, the same for the same arguments '''
+  generator = random.Random(seed)
+  rows = []
+
+  for y in range(height):
+    row = []
+
+    for x in range(width):
+      if x == 0 or y == 0 or x == width - 1 or y == height - 1:
+        row.append('#')
+      else:
+        value = generator.random()
+        row.append('#' if value < 0.08 else '~' if value < 0.11 else '.')
+
+    rows.append(''.join(row))
+
+  outputFile = open(filename, 'w')
+  try:
+    outputFile.write('\n'.join(rows) + '\n')
+  finally:
+    outputFile.close()
+
+def peakMemory():
+  ''' Returns the peak resident memory of this process in megabytes, or None
+      where it is not known '''
+  if resource is None:
+    return None
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  # Bytes on macOS, kilobytes elsewhere
+  if sys.platform == 'darwin':
+    return peak / float(1 << 20)
+
+  return peak / 1024.0
+
+def percentile(values, fraction):
+  ''' Returns the value below which the given fraction of the sorted values lie '''
+  if len(values) == 0:
+    return 0.0
+
+  return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def runScenario(scenario, seed = 1):
+  ''' Runs a scenario and returns a dictionary of its measurements, the
+      number of behaviour turns and the monsters' total fruit eaten and
+      moves. The latter stay the same between runs unless the behaviour of
+      the engine or of the monsters changed '''
+  random.seed(seed)
+
+  directory = None
+  filename = scenario['world']
+
+  try:
+    if not isinstance(filename, str):
+      directory = tempfile.mkdtemp()
+      width, height = filename
+      filename = os.path.join(directory, '%s.world' % scenario['name'])
+      generateWorld(width, height, seed, filename)
+
+      if scenario.get('compiled'):
+        worldfile.compileWorld(filename, filename + '.mworld')
+        filename += '.mworld'
+
+    start = time.perf_counter()
+    world = World(filename, seed)
+    loadSeconds = time.perf_counter() - start
+  finally:
+    if directory is not None:
+      shutil.rmtree(directory)
+
+  world.setSpeechEnabled(False)
+
+  latencies = []
+
+  for name, count in scenario['monsters']:
+    monsterClass = loadMonsterClass(name)
+
+    for i in range(count):
+      monster = monsterClass(world, len(world.monsters) % 10 + 1)
+      world.addMonster(monster)
+      monster.behaviour = timedBehaviour(monster.behaviour, latencies)
+
+  start = time.perf_counter()
+  world.run(scenario['ticks'])
+  runSeconds = time.perf_counter() - start
+
+  latencies.sort()
+  statistics = [monster.statistics() for monster in world.monsters]
+
+  return {'loadSeconds' : loadSeconds, 'runSeconds' : runSeconds,
+          'turns' : len(latencies), 'turnsPerSecond' : len(latencies) / runSeconds,
+          'p50Microseconds' : percentile(latencies, 0.5) * 1e6,
+          'p99Microseconds' : percentile(latencies, 0.99) * 1e6,
+          'peakMemoryMB' : peakMemory(),
+          'fruitEaten' : sum(row['fruitEaten'] for row in statistics),
+          'moves' : sum(row['moves'] for row in statistics)}
+
+def timedBehaviour(behaviour, latencies):
+  ''' Wraps a behaviour() method to append the time of each call to latencies '''
+  def timed():
+    start = time.perf_counter()
+    behaviour()
+    latencies.append(time.perf_counter() - start)
+
+  return timed
+
+def runBenchmarks(names = None, repeat = 1):
+  ''' Runs the named scenarios, or all of them, each repeat times in a fresh
+      process, and returns a dictionary of results by scenario name, keeping
+      the best value of each measurement over the repeats '''
+  selected = [scenario for scenario in scenarios if names is None or scenario['name'] in names]
+  results = {}
+
+  for scenario in selected:
+    # One process for each run, so that peak memory is the scenario's own
+    pool = multiprocessing.Pool(1, maxtasksperchild = 1)
+    try:
+      runs = pool.map(runScenario, [scenario] * repeat, chunksize = 1)
+    finally:
+      pool.close()
+      pool.join()
+
+    best = dict(runs[0])
+
+    for run in runs[1:]:
+      for name, higherIsBetter in metrics:
+        if run[name] is not None:
+          best[name] = (max if higherIsBetter else min)(best[name], run[name])
+
+    results[scenario['name']] = best
+
+  return results
+
+def compare(results, baseline, tolerance):
+  ''' Compares results with a baseline. Returns lines of text with the ratio
+      of each measurement to the baseline, and the list of measurements
+      which got worse by more than the tolerance, a fraction '''
+  lines = ['%-8s %-16s %12s %12s %8s' % ('scenario', 'metric', 'baseline', 'now', 'ratio')]
+  regressions = []
+
+  for scenario, row in sorted(results.items()):
+    old = baseline.get(scenario)
+
+    if old is None:
+      lines.append('%-8s not in the baseline' % scenario)
+      continue
+
+    for name, higherIsBetter in metrics:
+      if row.get(name) is None or not old.get(name):
+        continue
+
+      ratio = row[name] / old[name]
+      worse = ratio < 1 - tolerance if higherIsBetter else ratio > 1 + tolerance
+
+      if worse:
+        regressions.append('%s %s' % (scenario, name))
+
+      lines.append('%-8s %-16s %12.4g %12.4g %7.2fx%s' % (scenario, name, old[name], row[name], ratio,
+                                                          ' worse' if worse else ''))
+
+    if (row['turns'], row['fruitEaten'], row['moves']) != (old['turns'], old['fruitEaten'], old['moves']):
+      lines.append('%-8s the simulation played out differently from the baseline' % scenario)
+
+  return lines, regressions
+
+def formatTable(results):
+  ''' Returns the results formatted as a text table '''
+  lines = ['%-8s %8s' % ('scenario', 'turns') + ''.join(' %16s' % name for name, higherIsBetter in metrics)]
+
+  for scenario, row in sorted(results.items()):
+    lines.append('%-8s %8d' % (scenario, row['turns'])
+                 + ''.join(' %16.4g' % row[name] if row[name] is not None else ' %16s' % '-'
+                           for name, higherIsBetter in metrics))
+
+  return '\n'.join(lines)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Measure the speed of the engine and of monsters.')
+  parser.add_argument('scenarios', nargs = '*', help = 'scenarios to run, all by default')
+  parser.add_argument('--list', action = 'store_true', help = 'list the scenarios and exit')
+  parser.add_argument('--repeat', type = int, default = 1, help = 'runs of each scenario, keeping the best')
+  parser.add_argument('--output', help = 'JSON file to save the results into')
+  parser.add_argument('--baseline', help = 'JSON file of earlier results to compare with')
+  parser.add_argument('--tolerance', type = float, default = 0.1,
+                      help = 'fraction by which a measurement may get worse than the baseline')
+  args = parser.parse_args()
+
+  if args.list:
+    for scenario in scenarios:
+      print('%-8s %-20s %5d monsters %6d ticks' % (scenario['name'], scenario['world'],
+                                                   sum(count for name, count in scenario['monsters']),
+                                                   scenario['ticks']))
+    sys.exit(0)
+
+  unknown = set(args.scenarios) - set(scenario['name'] for scenario in scenarios)
+  if len(unknown) != 0:
+    parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+  results = runBenchmarks(args.scenarios or None, args.repeat)
+
+  print(formatTable(results))
+
+  if args.output is not None:
+    outputFile = open(args.output, 'w')
+    try:
+      json.dump({'python' : platform.python_version(), 'platform' : platform.platform(),
+                 'date' : time.strftime('%Y-%m-%d %H:%M:%S'), 'results' : results}, outputFile, indent = 1)
+    finally:
+      outputFile.close()
+
+  if args.baseline is not None:
+    inputFile = open(args.baseline)
+    try:
+      baseline = json.load(inputFile)['results']
+    finally:
+      inputFile.close()
+
+    lines, regressions = compare(results, baseline, args.tolerance)
+    print('')
+    print('\n'.join(lines))
+
+    if len(regressions) != 0:
+      sys.exit(1)
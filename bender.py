@@ -1,3 +1,5 @@
+import copy
+
 from monsters import *
 
 # A monster which gathers the knowledge about the world map and then uses Lees algorithm to find
@@ -8,41 +10,21 @@ class Bender(Monster):
 
   def onCreate(self):
     self.fruitValue = {}
-    self.field = {}
-
-    for x in range(World.size):
-      for y in range(World.size):
-        self.field[QPoint(x,y)] = '?'
+    self.field = KnowledgeMap(self.worldRect().width(), self.worldRect().height())
 
     self.say("Hi! I am Bender")
 
+  def onCopy(self):
+    # Copies of Bender in forks and snapshots of the world learn on their own
+    self.field = copy.copy(self.field)
+    self.fruitValue = dict(self.fruitValue)
+
   def getFruitValue(self, fruitType):
     if fruitType in self.fruitValue.keys():
       return self.fruitValue[fruitType]
     else:
       return 0
 
-  def cmpFruit(self, firstFruit, secondFruit):
-    (firstFruitPos, firstFruitType) = firstFruit
-    (secondFruitPos, secondFruitType) = secondFruit
-
-    firstFruitValue = self.getFruitValue(firstFruitType)
-    secondFruitValue = self.getFruitValue(secondFruitType)
-
-    if firstFruitValue < secondFruitValue:
-      return 1
-    elif firstFruitValue == secondFruitValue:
-      firstFruitDistance = (firstFruitPos - self.pos()).manhattanLength()
-      secondFruitDistance = (secondFruitPos - self.pos()).manhattanLength()
-      if  firstFruitDistance < secondFruitDistance:
-        return -1
-      elif firstFruitDistance == secondFruitDistance: 
-        return 0
-      else:
-        return 1
-    else:
-      return -1
-
   def behaviour(self):
     if self.isOnFruit():
       energyBefore = self.energy()
@@ -52,104 +34,63 @@ class Bender(Monster):
     if self.isOnItem():
       self.pickItem()
 
+    senses = self.sense()
+
     for direction in self.allDirections:
       target = self.pos() + World.movingVector[direction]
 
-      if self.canMove(direction):
-        self.field[target] = '.'
+      if senses.canMove(direction):
+        self.field[target] = KnowledgeMap.Free
       else:
-        self.field[target] = '#'
+        self.field[target] = KnowledgeMap.Blocked
 
     direction = self.getDirection()
       
-    if direction != None and self.canMove(direction):
+    if direction != None and senses.canMove(direction):
       self.move(direction)
     else:
       self.moveRandomly()
-      
-    #for y in range(0,World.size):
-    #  row = ""
-    #  for x in range(0,World.size):
-    #    if QPoint(x,y) == self.pos():
-    #      row += 'O'
-    #    else:
-    #      row += self.field[QPoint(x,y)]
-    #  print row
-    #print ''
 
   def getDirection(self):
 
     for d in self.allDirections:
-      if self.field[self.pos() + World.movingVector[d]] == '?': # Move to unknown
+      if self.field[self.pos() + World.movingVector[d]] == KnowledgeMap.Unknown: # Move to unknown
         return d
 
-    fieldCopy = {}
-  
-    for cell in self.field.keys():
-      if self.field[cell] == '#':
-        fieldCopy[cell] = -2
-      elif self.field[cell] == '?':
-        fieldCopy[cell] = -1
-      else:
-        fieldCopy[cell] = 0
-
-    # Start position
-    fieldCopy[self.pos()] = 1
-    
-    haveMore = True
-    iteration = 1 
-
-    while haveMore:
-      haveMore = False
-
-      for pos in fieldCopy.keys():
-
-        if fieldCopy[pos] == iteration:
-          haveMore = True
+    # Number of moves to every known cell which can be reached, -1 for the others
+    self.field.distances(self.pos())
+    distance = self.field.distance
 
-          for d in self.allDirections:
-            target = pos + World.movingVector[d]
+    nearbyFruitPos = [p for (p, t) in self.smell() if distance(p) > 0]
 
-            if World.rect.contains(target) and fieldCopy[target] == 0:
-                fieldCopy[target] = iteration + 1
-
-      iteration += 1
-
-    nearbyFruitPos = [p for (p, t) in self.smell() if fieldCopy[p] > 1]
-
-    nearbyFruitPos = sorted(nearbyFruitPos, key = lambda p: fieldCopy[p])
+    nearbyFruitPos = sorted(nearbyFruitPos, key = distance)
 
     if len(nearbyFruitPos) != 0:
       currentPos = nearbyFruitPos[0]
     else:
       currentPos = None
 
-    accessible = [cell for cell in fieldCopy.keys() if fieldCopy[cell] > 1]
+    # The nearest reachable cell next to an unknown one
+    unexplored = [cell for cell in self.field.frontier() if distance(cell) > 0]
 
     bestCell = None
 
-    for cell in accessible:
-      unknown = 0
-      for neighbour in (cell + World.movingVector[d] for d in self.allDirections):
-        if fieldCopy[neighbour] == -1:
-          unknown += 1
-
-      if unknown > 0 and (bestCell == None or fieldCopy[cell] < fieldCopy[bestCell]):
-        bestCell = cell
+    if len(unexplored) != 0:
+      bestCell = min(unexplored, key = lambda cell: (distance(cell), cell.x(), cell.y()))
 
     if bestCell != None:
-      if currentPos == None or fieldCopy[bestCell] < fieldCopy[currentPos]:
+      if currentPos == None or distance(bestCell) < distance(currentPos):
         currentPos = bestCell
 
     if currentPos == None:
       return None
 
-    iteration = fieldCopy[currentPos]
+    iteration = distance(currentPos)
     # Follow path from current position to the one next to monster position
-    while iteration != 2:
+    while iteration != 1:
       for d in self.allDirections:
         newPos = currentPos + World.movingVector[d]
-        if World.rect.contains(newPos) and fieldCopy[newPos] == iteration - 1:
+        if distance(newPos) == iteration - 1:
           currentPos = newPos
       iteration -= 1
   
@@ -157,4 +98,4 @@ class Bender(Monster):
 
     for direction in World.movingVector.keys():
       if World.movingVector[direction] == vector:
-        return direction
\ No newline at end of file
+        return direction
@@ -0,0 +1,157 @@
+''' Writing monsters as coroutines.
+
+    Instead of a behaviour() method deciding one step at a time, a
+    CoroutineMonster has a run() coroutine which can follow a plan over many
+    turns, awaiting its moves:
+
+      class Walker(CoroutineMonster):
+        async def run(self):
+          for direction in self.pathTo(Point(10, 10)) or []:
+            if not await self.step(direction):
+              break
+
+    The coroutines are driven by the clock of the world: an awaited step()
+    returns once the monster has arrived, so a run() takes exactly as much
+    simulation time as its steps and naps, whether the world runs in a window
+    or headless. Coroutines are resumed from the world's scheduler, not an
+    asyncio event loop, so they must only await the methods below. The rest
+    of the monster API, move() and sleep() included, works as for any
+    monster, e.g. on the monsters of a fork of the world.
+'''
+
+from monsters import World, Monster
+
+class _NextTurn(object):
+  ''' Awaitable suspending a run() coroutine until the next behaviour turn of
+      its monster '''
+
+  def __await__(self):
+    yield
+
+_nextTurn = _NextTurn()
+
+class CoroutineMonster(Monster):
+  ''' A monster driven by its run() coroutine rather than behaviour(). When
+      run() returns it is started again on the next turn. step(),
+      stepRandomly(), nap() and wait() are the awaitable counterparts of
+      move(), moveRandomly() and sleep(), to be awaited in run(). A snapshot or
+      fork of the world can not copy a coroutine half way through, so the
+      monsters in a fork, and a monster restored from a snapshot, start their
+      run() again from the beginning '''
+
+  def __init__(self, world, monsterType, position = None):
+    # The run() coroutine, started on the first turn
+    self._coroutine = None
+
+    # The event ending an awaited wait(), which gives the monster its next turn
+    self._waitEvent = None
+
+    super(CoroutineMonster, self).__init__(world, monsterType, position)
+
+  def _copyState(self, original, world, objects, events):
+    super(CoroutineMonster, self)._copyState(original, world, objects, events)
+    self._coroutine = None
+    self._waitEvent = events.get(id(original._waitEvent))
+
+  def _endWait(self):
+    self._waitEvent = None
+    self._requestTurn()
+
+  def behaviour(self):
+    if self._isSleeping:
+      # The monster woke up for the end of a move, it goes on once awake
+      return
+
+    if self._coroutine is None:
+      self._coroutine = self.run()
+
+    try:
+      self._coroutine.send(None)
+    except StopIteration:
+      self._coroutine = None
+
+    if (self._targetPos is None and not self._isSleeping and not self._turnPending and
+        self._waitEvent is None):
+      # Awaited nothing which gives it another turn, so go on after a while
+      self._missTurn()
+
+  #=============================================================================
+  # Monster creators API
+  #=============================================================================
+
+  async def run(self):
+    ''' The main coroutine of the monster. To be implemented by monsters
+        creators '''
+    await self.wait()
+
+  async def step(self, direction):
+    ''' Moves monster in specified direction, like move(). Returns True once
+        the monster has arrived, or False on its next turn if it could not
+        move '''
+    moves = self._moves
+    self.move(direction)
+
+    await _nextTurn
+    while self._targetPos is not None:
+      await _nextTurn
+
+    return self._moves != moves
+
+  async def stepRandomly(self):
+    ''' Moves monster to the random movable direction, like moveRandomly().
+        Returns False if it could not move anywhere '''
+    passable = self.sense().passable
+    allDirections = [World.North, World.South, World.East, World.West]
+    movableDirections = [d for d in allDirections if passable[d]]
+
+    if len(movableDirections) == 0:
+      await self.wait()
+      return False
+
+    return await self.step(self._world._random.choice(movableDirections))
+
+  async def nap(self, seconds):
+    ''' Sleeps for the specified number of seconds, like sleep(), returning
+        on waking up '''
+    self.sleep(seconds)
+    await _nextTurn
+
+  async def wait(self, milliseconds = Monster._moveDuration):
+    ''' Does nothing for the specified number of milliseconds '''
+    self._waitEvent = self._world._scheduler.schedule(milliseconds, self._endWait)
+    await _nextTurn
+
+  #=============================================================================
+  # End of monster creators API
+  #=============================================================================
+
+class WalkerMonster(CoroutineMonster):
+  ''' Example of a coroutine monster: computes a path to the nearest fruit it
+      can smell, and walks all of it, only planning again when the path is
+      blocked or the fruit is gone '''
+
+  def onCreate(self):
+    self.say("Hi! I am WalkerMonster")
+
+  async def run(self):
+    while True:
+      if self.isOnFruit():
+        self.eatFruit()
+
+      if self.isOnItem():
+        self.pickItem()
+
+      fruits = [pos for pos, fruitType in self.smell() if pos != self.pos()]
+      path = None
+
+      if len(fruits) != 0:
+        target = min(fruits, key = lambda pos: (pos - self.pos()).manhattanLength())
+        path = self.pathTo(target)
+
+      if not path:
+        await self.stepRandomly()
+        continue
+
+      for direction in path:
+        if not await self.step(direction) or self.isOnFruit():
+          break
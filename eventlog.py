@@ -0,0 +1,500 @@
+''' Recording what happens in a world into a compact append-only log, and
+    replaying it.
+
+    A log starts with a header naming the world file, followed by records of
+    one kind byte and a fixed struct each (see recordFormats), a few of them
+    followed by a string. A Time record is only written when the simulation
+    time changes, and every keyframeInterval milliseconds of simulation time a
+    Keyframe record holds the full state of the world, so a replay can jump
+    to any time by starting from the keyframe before it instead of from the
+    beginning.
+
+    To record a run:
+
+      log = EventLog(world, 'run.mlog')
+      world.run(60000)
+      log.close()
+
+    To replay it in a window, or print its records:
+
+      python eventlog.py replay run.mlog
+      python eventlog.py dump run.mlog
+'''
+
+import argparse, bisect, math, pickle, struct, sys
+
+from monsters import World
+
+# Magic bytes and version at the start of a log
+magic = b'MLOG'
+version = 1
+
+# Kinds of records
+(Time, Keyframe, MonsterAdded, FruitAdded, Moved, Energy, Ate, Picked,
+ RingLost, Slept, Woke, Said) = range(12)
+
+# Struct of each kind of record. Keyframes and MonsterAdded and Said records
+# end in a string of bytes whose length is the last field
+recordFormats = {Time         : '<d',    # time
+                 Keyframe     : '<I',    # length of the pickled state
+                 MonsterAdded : '<IiiH', # monster, x, y, length of the image
+                 FruitAdded   : '<IBii', # fruit, type, x, y
+                 Moved        : '<IBf',  # monster, direction, length of the move
+                 Energy       : '<If',   # monster, energy
+                 Ate          : '<II',   # monster, fruit
+                 Picked       : '<I',    # monster
+                 RingLost     : '<ii',   # x, y
+                 Slept        : '<If',   # monster, seconds
+                 Woke         : '<I',    # monster
+                 Said         : '<IfH'}  # monster, seconds or NaN, length of the message
+
+recordNames = {Time : 'time', Keyframe : 'keyframe', MonsterAdded : 'monsterAdded',
+               FruitAdded : 'fruitAdded', Moved : 'moved', Energy : 'energy', Ate : 'ate',
+               Picked : 'picked', RingLost : 'ringLost', Slept : 'slept', Woke : 'woke',
+               Said : 'said'}
+
+_structs = dict((kind, struct.Struct(recordFormat)) for kind, recordFormat in recordFormats.items())
+
+# Kinds of records ending in a string
+_stringRecords = (Keyframe, MonsterAdded, Said)
+
+class EventLog(object):
+  ''' Records the spawns, moves, energy changes, eating, picking up and losing
+      the ring, sleeping and messages of a world into a log file. Records are
+      packed as they happen and written in large blocks, so recording adds
+      little to the cost of a run '''
+
+  # Simulation time between keyframes, in milliseconds
+  keyframeInterval = 10000
+
+  # Bytes of records gathered before they are written to the file
+  bufferSize = 1 << 16
+
+  def __init__(self, world, filename):
+    self._world = world
+    self._file = open(filename, 'wb')
+    self._buffer = []
+    self._bufferLength = 0
+    self._time = None
+
+    # Numbers of the fruits, which unlike monsters have no index of their own
+    self._fruitIds = {}
+    self._nextFruitId = 0
+
+    header = world.filename.encode('utf-8')
+    self._file.write(magic + struct.pack('<HH', version, len(header)) + header)
+
+    for fruit in world.fruits:
+      self._fruitId(fruit)
+
+    world._eventLog = self
+    self._keyframe()
+
+  def close(self):
+    ''' Stops recording and writes the rest of the log '''
+    if self._world._eventLog is self:
+      self._world._eventLog = None
+
+    self._flush()
+    self._file.close()
+
+  def worldRestored(self):
+    ''' Records a keyframe after World.restore() replaced the fruits and
+        the pending events, and schedules keyframes again '''
+    self._fruitIds = {}
+    for fruit in self._world.fruits:
+      self._fruitId(fruit)
+
+    self._keyframe()
+
+  def monsterAdded(self, monster):
+    image = monster._image.encode('utf-8')
+    self._write(MonsterAdded, monster._index, monster._pos._x, monster._pos._y, len(image), image)
+    self.energyChanged(monster)
+
+  def fruitAdded(self, fruit):
+    self._write(FruitAdded, self._fruitId(fruit), fruit._type, fruit._pos._x, fruit._pos._y)
+
+  def monsterMoved(self, monster, direction):
+    self._write(Moved, monster._index, direction, monster._moveLength)
+
+  def energyChanged(self, monster):
+    self._write(Energy, monster._index, monster._energy)
+
+  def fruitEaten(self, monster, fruit):
+    self._write(Ate, monster._index, self._fruitIds.pop(fruit))
+
+  def itemPicked(self, monster, item):
+    self._write(Picked, monster._index)
+
+  def ringLost(self, ring):
+    self._write(RingLost, ring._pos._x, ring._pos._y)
+
+  def monsterSlept(self, monster, seconds):
+    self._write(Slept, monster._index, seconds)
+
+  def monsterWoke(self, monster):
+    self._write(Woke, monster._index)
+
+  def monsterSaid(self, monster, message, seconds):
+    message = message.encode('utf-8')
+    self._write(Said, monster._index, float('nan') if seconds is None else seconds, len(message), message)
+
+  def _fruitId(self, fruit):
+    if not fruit in self._fruitIds:
+      self._fruitIds[fruit] = self._nextFruitId
+      self._nextFruitId += 1
+
+    return self._fruitIds[fruit]
+
+  def _keyframe(self):
+    ''' Records the full state of the world, and schedules the next keyframe '''
+    if self._world._eventLog is not self:
+      return
+
+    state = stateOf(self._world, self._fruitIds)
+    data = pickle.dumps((state.monsters, state.fruits, state.ring), pickle.HIGHEST_PROTOCOL)
+    self._write(Keyframe, len(data), data)
+
+    self._world._scheduler.schedule(EventLog.keyframeInterval, self._keyframe)
+
+  def _write(self, kind, *fields):
+    time = self._world.time()
+
+    if time != self._time:
+      self._time = time
+      self._append(bytes((Time,)) + _structs[Time].pack(time))
+
+    if kind in _stringRecords:
+      record = bytes((kind,)) + _structs[kind].pack(*fields[:-1]) + fields[-1]
+    else:
+      record = bytes((kind,)) + _structs[kind].pack(*fields)
+
+    self._append(record)
+
+  def _append(self, record):
+    self._buffer.append(record)
+    self._bufferLength += len(record)
+
+    if self._bufferLength >= EventLog.bufferSize:
+      self._flush()
+
+  def _flush(self):
+    self._file.write(b''.join(self._buffer))
+    self._buffer = []
+    self._bufferLength = 0
+
+def stateOf(world, fruitIds):
+  ''' Returns the state of a world as a ReplayState '''
+  state = ReplayState(world.time())
+
+  for monster in world.monsters:
+    target = None
+    if monster._targetPos is not None:
+      target = (monster._targetPos._x, monster._targetPos._y)
+
+    state.monsters[monster._index] = [monster._image, (monster._pos._x, monster._pos._y), target,
+                                      monster._moveStart, monster._moveLength, monster._energy,
+                                      monster._isSleeping, None]
+
+  for fruit, fruitId in fruitIds.items():
+    if not fruit._isVanished:
+      state.fruits[fruitId] = (fruit._type, (fruit._pos._x, fruit._pos._y))
+
+  ring = world.rubberRing
+  owner = None
+  if ring._owner is not None and ring in ring._owner._items:
+    owner = ring._owner._index
+
+  state.ring = [(ring._pos._x, ring._pos._y), owner]
+
+  return state
+
+class ReplayState(object):
+  ''' State of a recorded world at some time, as plain values '''
+
+  # Fields of the lists in monsters
+  Image, Pos, Target, MoveStart, MoveLength, Energy, Sleeping, Message = range(8)
+
+  def __init__(self, time):
+    self.time = time
+
+    # Monsters by index, as lists of the fields above. Message is a tuple
+    # (message, time said, seconds or None) or None
+    self.monsters = {}
+
+    # Fruits by number, as tuples (type, (x, y))
+    self.fruits = {}
+
+    # Position of the rubber ring, and the index of the monster owning it or None
+    self.ring = [(0, 0), None]
+
+  def finishMoves(self):
+    ''' Puts the monsters whose moves are over into their target cells '''
+    for monster in self.monsters.values():
+      if monster[ReplayState.Target] is not None and \
+         monster[ReplayState.MoveStart] + monster[ReplayState.MoveLength] <= self.time:
+        monster[ReplayState.Pos] = monster[ReplayState.Target]
+        monster[ReplayState.Target] = None
+
+  def apply(self, kind, fields):
+    ''' Applies a record other than Time or Keyframe. Records of monsters or
+        fruits the state does not know, e.g. from a log written by an older
+        version, are skipped '''
+    if kind == MonsterAdded:
+      index, x, y, image = fields
+      self.monsters[index] = [image.decode('utf-8'), (x, y), None, 0, 0, 0, False, None]
+    elif kind == FruitAdded:
+      fruitId, fruitType, x, y = fields
+      self.fruits[fruitId] = (fruitType, (x, y))
+    elif kind == Ate:
+      self.fruits.pop(fields[1], None)
+    elif kind == Picked:
+      self.ring[1] = fields[0]
+    elif kind == RingLost:
+      self.ring = [fields, None]
+    elif fields[0] in self.monsters:
+      monster = self.monsters[fields[0]]
+
+      if kind == Moved:
+        x, y = monster[ReplayState.Target] or monster[ReplayState.Pos]
+        vector = World.movingVector[fields[1]]
+        monster[ReplayState.Pos] = (x, y)
+        monster[ReplayState.Target] = (x + vector.x(), y + vector.y())
+        monster[ReplayState.MoveStart] = self.time
+        monster[ReplayState.MoveLength] = fields[2]
+      elif kind == Energy:
+        monster[ReplayState.Energy] = fields[1]
+      elif kind == Slept:
+        monster[ReplayState.Sleeping] = True
+      elif kind == Woke:
+        monster[ReplayState.Sleeping] = False
+      elif kind == Said:
+        seconds = None if math.isnan(fields[1]) else fields[1]
+        monster[ReplayState.Message] = (fields[2].decode('utf-8'), self.time, seconds)
+
+class Replay(object):
+  ''' A recorded log, which can tell the state of the world at any time
+      without running the monsters again '''
+
+  def __init__(self, filename):
+    logFile = open(filename, 'rb')
+    try:
+      self._data = logFile.read()
+    finally:
+      logFile.close()
+
+    if self._data[:len(magic)] != magic:
+      raise ValueError('%s: not an event log' % filename)
+
+    logVersion, headerLength = struct.unpack_from('<HH', self._data, len(magic))
+    if logVersion != version:
+      raise ValueError('%s: event log of version %d, expected %d' % (filename, logVersion, version))
+
+    start = len(magic) + 4
+
+    # Name of the world file the log was recorded in
+    self.worldFilename = self._data[start : start + headerLength].decode('utf-8')
+
+    # Offset of the first record
+    self._start = start + headerLength
+
+    # Times and offsets of the keyframes, and the time of the last record
+    self._keyframeTimes = []
+    self._keyframeOffsets = []
+    self.duration = 0
+
+    for offset, time, kind, fields in self.records():
+      if kind == Keyframe:
+        # After World.restore() the log goes on from an earlier time, and the
+        # keyframes recorded after that time no longer apply
+        while len(self._keyframeTimes) != 0 and self._keyframeTimes[-1] >= time:
+          self._keyframeTimes.pop()
+          self._keyframeOffsets.pop()
+
+        self._keyframeTimes.append(time)
+        self._keyframeOffsets.append(offset)
+
+      self.duration = time
+
+  def records(self, offset = None, time = 0):
+    ''' Yields (offset, time, kind, fields) for the records from the offset on,
+        which is at the given time. The fields of records ending in a string
+        end in the string instead of its length '''
+    data = self._data
+    if offset is None:
+      offset = self._start
+
+    while offset < len(data):
+      recordOffset = offset
+      kind = data[offset]
+      recordStruct = _structs[kind]
+      fields = recordStruct.unpack_from(data, offset + 1)
+      offset += 1 + recordStruct.size
+
+      if kind in _stringRecords:
+        fields = fields[:-1] + (data[offset : offset + fields[-1]],)
+        offset += len(fields[-1])
+
+      if kind == Time:
+        time = fields[0]
+        continue
+
+      yield recordOffset, time, kind, fields
+
+  def stateAt(self, time):
+    ''' Returns the ReplayState at the specified simulation time '''
+    keyframe = max(bisect.bisect_right(self._keyframeTimes, time) - 1, 0)
+    state = None
+
+    for offset, recordTime, kind, fields in self.records(self._keyframeOffsets[keyframe],
+                                                         self._keyframeTimes[keyframe]):
+      if recordTime > time:
+        break
+
+      if kind == Keyframe:
+        if state is None:
+          state = ReplayState(recordTime)
+          state.monsters, state.fruits, state.ring = pickle.loads(fields[0])
+        continue
+
+      state.time = recordTime
+      state.finishMoves()
+      state.apply(kind, fields)
+
+    state.time = max(state.time, time)
+    state.finishMoves()
+
+    return state
+
+class ReplayView(object):
+  ''' Window replaying a log. Left and Right jump a second back or forward,
+      Page Up and Page Down ten seconds, Home and End to the beginning and
+      end, and Space pauses '''
+
+  def __init__(self, replay, startTime = 0):
+    # Qt is only loaded when a replay is shown, as for World.simulate()
+    from PySide6.QtCore import QTimer, Qt
+    from PySide6.QtGui import QKeySequence, QShortcut
+    from PySide6.QtWidgets import QApplication, QGraphicsView, QGraphicsPixmapItem
+    from views import SpriteCache, TerrainScene, WorldView
+
+    self._replay = replay
+    self._time = startTime
+    self._playing = True
+    self._cellSize = WorldView.cellSize
+    self._pixmapItem = QGraphicsPixmapItem
+    self._pixmap = SpriteCache.pixmap
+
+    self._app = QApplication.instance() or QApplication(sys.argv)
+
+    # The world is only created for its terrain
+    world = World(replay.worldFilename)
+
+    self.scene = TerrainScene(world, self._cellSize)
+    self.scene.setSceneRect(0, 0, self._cellSize * world.width, self._cellSize * world.height)
+
+    self.view = QGraphicsView(self.scene)
+    self.view.setDragMode(QGraphicsView.ScrollHandDrag)
+    self.view.setCacheMode(QGraphicsView.CacheBackground)
+    self.view.resize(800, 600)
+
+    for key, seconds in [(Qt.Key_Left, -1), (Qt.Key_Right, 1), (Qt.Key_PageUp, -10), (Qt.Key_PageDown, 10)]:
+      QShortcut(QKeySequence(key), self.view, lambda seconds = seconds: self.seek(self._time + seconds * 1000))
+
+    QShortcut(QKeySequence(Qt.Key_Home), self.view, lambda: self.seek(0))
+    QShortcut(QKeySequence(Qt.Key_End), self.view, lambda: self.seek(replay.duration))
+    QShortcut(QKeySequence(Qt.Key_Space), self.view, self.pause)
+
+    # Graphics items of the objects shown, by ('monster', index), ('fruit',
+    # number) or ('ring', 0)
+    self._items = {}
+
+    self._timer = QTimer()
+    self._timer.timeout.connect(self._frame)
+    self._frameLength = 40
+
+  def exec_(self):
+    self._show()
+    self.view.show()
+    self._timer.start(self._frameLength)
+    self._app.exec()
+
+  def seek(self, time):
+    ''' Shows the world at the specified simulation time '''
+    self._time = min(max(time, 0), self._replay.duration)
+    self._show()
+
+  def pause(self):
+    self._playing = not self._playing
+
+  def _frame(self):
+    if self._playing and self._time < self._replay.duration:
+      self.seek(self._time + self._frameLength)
+
+  def _show(self):
+    state = self._replay.stateAt(self._time)
+    shown = {}
+
+    for fruitId, (fruitType, pos) in state.fruits.items():
+      shown[('fruit', fruitId)] = ('./images/fruit%d.png' % fruitType, pos, 1)
+
+    if state.ring[1] is None:
+      shown[('ring', 0)] = ('./images/rubber_ring.png', state.ring[0], 1)
+
+    for index, monster in state.monsters.items():
+      x, y = monster[ReplayState.Pos]
+
+      if monster[ReplayState.Target] is not None:
+        # Interpolate the move
+        progress = (state.time - monster[ReplayState.MoveStart]) / monster[ReplayState.MoveLength]
+        targetX, targetY = monster[ReplayState.Target]
+        x, y = x + (targetX - x) * progress, y + (targetY - y) * progress
+
+      shown[('monster', index)] = (monster[ReplayState.Image], (x, y), 2)
+
+    for key in list(self._items.keys()):
+      if not key in shown:
+        self.scene.removeItem(self._items.pop(key))
+
+    for key, (image, (x, y), z) in shown.items():
+      if not key in self._items:
+        item = self._pixmapItem(self._pixmap(image, self._cellSize))
+        item.setZValue(z)
+        self.scene.addItem(item)
+        self._items[key] = item
+
+      self._items[key].setPos(x * self._cellSize, y * self._cellSize)
+
+    self.view.setWindowTitle('Replay %.1f s / %.1f s' % (state.time / 1000.0, self._replay.duration / 1000.0))
+
+def dump(replay):
+  ''' Prints the records of a replay, one per line '''
+  for offset, time, kind, fields in replay.records():
+    if kind == Keyframe:
+      monsters, fruits, ring = pickle.loads(fields[0])
+      fields = ('%d monsters, %d fruits' % (len(monsters), len(fruits)),)
+    elif kind in _stringRecords:
+      fields = fields[:-1] + (fields[-1].decode('utf-8'),)
+
+    print('%10.1f %-12s %s' % (time, recordNames[kind], ' '.join(str(field) for field in fields)))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Replay or print recorded event logs.')
+  commands = parser.add_subparsers(dest = 'command')
+
+  replayCommand = commands.add_parser('replay', help = 'replay a log in a window')
+  replayCommand.add_argument('log')
+  replayCommand.add_argument('--time', type = float, default = 0, help = 'simulation time to start at, in milliseconds')
+
+  dumpCommand = commands.add_parser('dump', help = 'print the records of a log')
+  dumpCommand.add_argument('log')
+
+  args = parser.parse_args()
+
+  if args.command == 'replay':
+    ReplayView(Replay(args.log), args.time).exec_()
+  elif args.command == 'dump':
+    dump(Replay(args.log))
+  else:
+    parser.print_help()
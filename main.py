@@ -14,14 +14,15 @@ class MyMonster(Monster):
       
     self.moveRandomly()
 
-# Create the world (should be done after simulation is created)
-world = World("worlds/water.world")
+if __name__ == '__main__':
+  # Create the world (should be done after simulation is created)
+  world = World("worlds/water.world")
 
-# Add monsters to the world
-world.addMonster(DefaultMonster(world, 1))
-world.addMonster(DefaultMonster(world, 2))
-world.addMonster(MyMonster(world, 3))
-world.addMonster(Bender(world, 9))
+  # Add monsters to the world
+  world.addMonster(DefaultMonster(world, 1))
+  world.addMonster(DefaultMonster(world, 2))
+  world.addMonster(MyMonster(world, 3))
+  world.addMonster(Bender(world, 9))
 
-# Start the simulation
-world.simulate()
\ No newline at end of file
+  # Start the simulation
+  world.simulate()
\ No newline at end of file
@@ -1,112 +1,731 @@
-import sys, random
+import random, time, heapq, copy, types, array
 
-from PySide.QtCore import *
-from PySide.QtGui import *
-from PySide.QtOpenGL import *
+from collections import OrderedDict, namedtuple
 
-class World(QApplication):
+import worldfile
 
-  # Size of each individual cell, in pixels
-  cellSize = 100
+class Point(object):
+  ''' Position of a cell in the world. Provides the part of the QPoint API
+      used by monsters, but is plain Python so a world can run without Qt '''
 
-  # Size of the world (to be set later)
-  size = None
+  __slots__ = ('_x', '_y')
+
+  def __init__(self, x = 0, y = 0):
+    self._x = x
+    self._y = y
+
+  def x(self):
+    return self._x
+
+  def y(self):
+    return self._y
+
+  def manhattanLength(self):
+    return abs(self._x) + abs(self._y)
+
+  def __add__(self, other):
+    return Point(self._x + other._x, self._y + other._y)
+
+  def __sub__(self, other):
+    return Point(self._x - other._x, self._y - other._y)
+
+  def __mul__(self, factor):
+    return Point(self._x * factor, self._y * factor)
+
+  def __neg__(self):
+    return Point(-self._x, -self._y)
+
+  def __eq__(self, other):
+    return isinstance(other, Point) and self._x == other._x and self._y == other._y
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self._x, self._y))
+
+  def __repr__(self):
+    return 'Point(%d, %d)' % (self._x, self._y)
+
+class Rect(object):
+  ''' Rectangle of cells, the plain Python counterpart of QRect '''
+
+  __slots__ = ('_x', '_y', '_width', '_height')
+
+  def __init__(self, x, y, width, height):
+    self._x = x
+    self._y = y
+    self._width = width
+    self._height = height
+
+  def width(self):
+    return self._width
+
+  def height(self):
+    return self._height
+
+  def contains(self, point):
+    return (self._x <= point._x < self._x + self._width and
+            self._y <= point._y < self._y + self._height)
+
+class Scheduler(object):
+  ''' The clock of a world. Every pending event in the world, such as the end
+      of a move, of an animation or of a second of sleep, is kept in one heap,
+      so advancing the clock costs the same per event however many objects
+      there are. Events due at the same time fire in the order they were
+      scheduled. Behaviour turns due at that time run after them in
+      round-robin order, starting one monster further each time, so that no
+      monster always gets the first pick '''
+
+  def __init__(self, world):
+    self._world = world
+
+    # Simulation time in milliseconds
+    self._time = 0
+
+    # Heap of pending events, each a list [deadline, sequence, callback]
+    # where the callback is None once the event is cancelled
+    self._events = []
+    self._sequence = 0
+
+    # Monsters waiting for a behaviour turn at the current time, and the
+    # monsters whose turns are running now, some of which may still wait
+    self._turns = []
+    self._running = []
+    self._round = 0
+
+    # Whether monsters get behaviour turns, which forks of a world may go without
+    self.behaviours = True
+
+    # Monster whose behaviour turn is running, if any
+    self._turnOwner = None
+
+    # Cost of the last call to advance()
+    self.frameStats = {'simulatedTime' : 0, 'events' : 0, 'turns' : 0, 'seconds' : 0.0}
+
+  def time(self):
+    return self._time
+
+  def schedule(self, delay, callback):
+    ''' Calls callback after delay milliseconds of simulation time. Returns
+        the event, which can be passed to cancel() '''
+    self._sequence += 1
+    event = [self._time + delay, self._sequence, callback]
+    heapq.heappush(self._events, event)
+    return event
+
+  def cancel(self, event):
+    ''' Cancels an event returned by schedule(). Does nothing for None or an
+        event which has already fired '''
+    if event is not None:
+      event[2] = None
+
+  def requestTurn(self, monster):
+    ''' Gives the monster a behaviour turn at the current time, unless it is
+        already waiting for one '''
+    if self.behaviours and not monster._turnPending:
+      monster._turnPending = True
+      self._turns.append(monster)
+
+  def _copy(self, world, objects):
+    ''' Returns a copy of the scheduler for a copy of its world, with the
+        callbacks of the events rebound to the copies of the objects given by
+        the objects dictionary. Events of anything else, e.g. an EventLog,
+        are dropped. Also returns a dictionary from the ids of the events to
+        their copies '''
+    scheduler = Scheduler(world)
+    scheduler._time = self._time
+    scheduler._sequence = self._sequence
+    scheduler._round = self._round
+
+    # Monsters of the running turns which did not get theirs yet, e.g. when a
+    # monster forks the world in its behaviour(), still wait in the copy
+    waiting = [monster for monster in self._running if monster._turnPending and not monster in self._turns]
+    scheduler._turns = [objects[monster] for monster in waiting + self._turns]
+
+    events = {}
+
+    for event in self._events:
+      callback = event[2]
+
+      if callback is not None:
+        owner = objects.get(getattr(callback, '__self__', None))
+        callback = types.MethodType(callback.__func__, owner) if owner is not None else None
+
+      # Copying the heap in order keeps it a heap
+      events[id(event)] = [event[0], event[1], callback]
+      scheduler._events.append(events[id(event)])
+
+    return scheduler, events
+
+  def _runTurns(self, monsters):
+    ''' Runs the behaviour turns of the monsters in the order given. Classes
+        of monsters which decide in batches, e.g. swarm.SwarmMonster, first
+        decide for all their monsters due now at once, from the world as it
+        is before any of these monsters act, and all of them act together on
+        the turn of the first one '''
+    batches = {}
+
+    for monster in monsters:
+      if monster._decidesInBatches:
+        batches.setdefault(type(monster), []).append(monster)
+
+    decisions = dict((monsterClass, monsterClass._decideBatch(batch)) for monsterClass, batch in batches.items())
+
+    for monster in monsters:
+      if not monster._decidesInBatches:
+        monster._takeTurn()
+      elif type(monster) in decisions:
+        monsterClass = type(monster)
+
+        for batchMonster in batches[monsterClass]:
+          batchMonster._turnPending = False
+
+        monsterClass._actOnBatch(batches[monsterClass], decisions.pop(monsterClass))
+
+  def advance(self, milliseconds):
+    ''' Advances the clock by the specified number of milliseconds, jumping
+        from one due event to the next '''
+    startTime = time.time()
+    events = turns = 0
+    endTime = self._time + milliseconds
+
+    while True:
+      if len(self._turns) == 0:
+        if len(self._events) == 0 or self._events[0][0] > endTime:
+          break
+
+        self._time = self._events[0][0]
+
+      # Fire the events due now, including ones scheduled by these callbacks
+      while len(self._events) != 0 and self._events[0][0] <= self._time:
+        event = heapq.heappop(self._events)
+        callback, event[2] = event[2], None
+
+        if callback is not None:
+          callback()
+          events += 1
+
+      if len(self._turns) != 0:
+        monsters, self._turns = self._turns, []
+        count = max(len(self._world.monsters), 1)
+        self._round += 1
+        monsters.sort(key = lambda monster: (monster._index - self._round) % count)
+
+        self._running = monsters
+        try:
+          if self._world._workers is not None:
+            self._world._workers.runTurns(monsters)
+          else:
+            self._runTurns(monsters)
+        finally:
+          self._running = []
+
+        turns += len(monsters)
+
+    self._time = max(self._time, endTime)
+
+    self.frameStats = {'simulatedTime' : milliseconds, 'events' : events, 'turns' : turns,
+                       'seconds' : time.time() - startTime}
+
+class World(object):
+
+  # Length of one simulation tick, in milliseconds
+  tickLength = 10
 
-  # QRect representing the field
-  rect = None
-  
   # enumeration for world directions
   North, South, East, West = range(4)
 
   # Direction moving vectors
-  movingVector = {North : QPoint(0, -1),
-                  South : QPoint(0, 1),
-                  East  : QPoint(1, 0),
-                  West  : QPoint(-1, 0)}
+  movingVector = {North : Point(0, -1),
+                  South : Point(0, 1),
+                  East  : Point(1, 0),
+                  West  : Point(-1, 0)}
 
   # Enumeration for the world object types
-  Nothing, Grass, Rock, Pond, Fruit, Item, Monster = range(7) 
+  Nothing, Grass, Rock, Pond, Fruit, Item, Monster = range(7)
+
+  # Layers of the occupancy grid. Each cell of the grid is a bitset telling
+  # which kinds of object are in it
+  _rockFlag, _pondFlag, _monsterFlag, _targetFlag, _fruitFlag, _itemFlag = [1 << i for i in range(6)]
+
+  # Layers a monster can not move into
+  _obstacleFlags = _rockFlag | _pondFlag | _monsterFlag | _targetFlag
+
+  # Width and height of the squares of cells fruits are grouped into for
+  # range queries
+  _fruitBucketSize = 16
+
+  # Worlds with more cells than this keep their cells in chunks of
+  # chunkSize x chunkSize cells, loading and dropping chunks as needed to
+  # stay within about chunkMemoryLimit bytes
+  flatCellLimit = 1 << 22
+  chunkSize = 64
+  chunkMemoryLimit = 64 << 20
 
-  def __init__(self, filename):
-    super(World, self).__init__(sys.argv)
+  def __init__(self, filename, seed = None):
+    # Random number generator used for everything random in the world, so a
+    # simulation started with the same seed plays out the same way
+    self._random = random.Random(seed)
 
-    # Lists containing various objects in the world
-    self.rocks = []
-    self.ponds = []
+    # Lists containing various objects in the world. Rocks and ponds never
+    # move, so rather than as objects they are kept in the occupancy grid
     self.fruits = []
     self.monsters = []
     self.rubberRing = None
 
-    worldFile = open(filename, "r")
-    worldFileLines = worldFile.readlines()
+    # Simulation clock and the events waiting on it
+    self._scheduler = Scheduler(self)
 
-    # Determine the size of the world using the number of the rows in the files
-    World.size = len(worldFileLines)
+    # Objects notified about changes in the world, e.g. a WorldView
+    self._observers = []
 
-    World.rect = QRect(0, 0, World.size, World.size)
+    # Whether the monsters have been given control yet
+    self._started = False
 
-    # Create a graphics scene to display objects
-    self.scene = QGraphicsScene()
-    self.scene.setSceneRect(0, 0, self.cellSize * self.size, self.cellSize * self.size);
+    # Whether the messages monsters say are passed on to the observers
+    self._speechEnabled = True
 
-    self.view = QGraphicsView(self.scene)
-    # Set up the view to use OpenGL as a rendering engine
-    self.view.setViewport(QGLWidget(QGLFormat(QGL.SampleBuffers)))
-    self.view.setDragMode(QGraphicsView.ScrollHandDrag)
-    self.view.setBackgroundBrush(QPixmap('./images/grass.png'));
-    self.view.setWindowTitle('Monsters');
-    self.view.resize(800, 600);
-    self.view.show()
+    # EventLog recording what happens in the world, or None
+    self._eventLog = None
 
-    # Add all the objects from the file to the world
-    for y in range(self.size): # No. of line
-      for x in range(self.size): # No. of character
+    # Profiler measuring the monsters of the world, or None
+    self._profiler = None
 
-        char = worldFileLines[y][x]
+    # WorkerPool running behaviours in other processes, or None
+    self._workers = None
 
-        pos = QPoint(x, y)
+    # Terrain of the world, from a text or compiled world file
+    self.filename = filename
+    data = worldfile.load(filename)
 
-        if char == '.': # Nothing (grass)
-          pass
-        elif char == '#': # Rock
-          self.rocks.append(Rock(random.randint(1,4), self, pos))
-        elif char == '~': # Pond
-          self.ponds.append(Pond(self, pos))
-        elif char == '*': # Source of gems
-          #TODO: place a source of gems
-          pass
-        else:
-          #TODO: throw an error here
-          pass
+    # Width and height of the world in cells
+    self.width = data.width
+    self.height = data.height
+
+    # Rect representing the field
+    self.rect = Rect(0, 0, self.width, self.height)
+
+    if self.width * self.height <= World.flatCellLimit:
+      # Occupancy grid, one byte of layer flags per cell stored row by row
+      terrain = bytes(data.terrain)
+      self._cells = bytearray(terrain.translate(World._terrainLayerTable()))
+
+      # Image of the rock in each cell, from 1 to 4, or 0 if there is no rock
+      self._rockTypes = bytearray(terrain.translate(World._rockTypeTable()))
+
+      # For each cell, the directions a monster can walk (low 4 bits) and swim
+      # (high 4 bits) to from it, bit 1 << direction being set if it can
+      self._neighbourMasks = bytearray(data.neighbours)
+    else:
+      # The same arrays for a large world, indexed the same way but only
+      # loaded chunk by chunk where monsters, fruits or views go
+      maxChunks = max(World.chunkMemoryLimit // (3 * World.chunkSize ** 2), 1)
+
+      self._cells = worldfile.ChunkedArray(self.width, self.height, data.terrain,
+                                           World._terrainLayerTable(), World.chunkSize, maxChunks)
+      self._rockTypes = worldfile.ChunkedArray(self.width, self.height, data.terrain,
+                                               World._rockTypeTable(), World.chunkSize, maxChunks)
+      self._neighbourMasks = worldfile.ChunkedArray(self.width, self.height, data.neighbours,
+                                                    None, World.chunkSize, maxChunks)
+
+    # Cells which are sources of gems
+    self.gemSources = []
+
+    for start, block in data.blocks(data.terrain):
+      index = block.find(worldfile.GemSource)
+
+      while index != -1:
+        self.gemSources.append(self._cellPos(start + index))
+        index = block.find(worldfile.GemSource, index + 1)
+
+    # Number of cells with no flags set, i.e. the ones without rocks or ponds
+    self._freeCount = sum(block.count(worldfile.Walkable | worldfile.Swimmable)
+                          for start, block in data.blocks(data.passability))
+
+    # Indices of the free cells, and the slot of each cell in that list, so
+    # free cells can be added, removed and sampled in O(1). Listing millions
+    # of cells takes a while, so while most cells are free, free cells are
+    # found by trying random ones instead and the list is only made once the
+    # world gets crowded
+    self._freeCells = None
+    self._freeSlots = None
+
+    # Whether the neighbour masks and the free cell index are shared with
+    # forks or snapshots of the world, so have to be copied before changing
+    self._masksShared = False
+    self._freeCellsShared = False
+
+    # Fruits by cell index, and by bucket of cells for range queries
+    self._fruitCells = {}
+    self._fruitBuckets = {}
+
+    # Shortest paths service for monsters
+    self.pathfinder = Pathfinder(self)
 
     # Add some fruits at random positions
-    for fruit in range(5):
-      self.addRandomFruit()
+    self.spawn(5)
 
     # Create rubber ring
     self.rubberRing = RubberRing(self)
     self.rubberRing._setRandomPos()
+    self._notify('objectAdded', self.rubberRing)
+
+  @staticmethod
+  def _terrainLayerTable():
+    ''' Returns the table for bytes.translate() from world file terrain to
+        occupancy grid flags '''
+    layers = {worldfile.Rock : World._rockFlag, worldfile.Pond : World._pondFlag}
+    return bytes(layers.get(terrain & 0x0f, 0) for terrain in range(256))
+
+  @staticmethod
+  def _rockTypeTable():
+    ''' Returns the table for bytes.translate() from world file terrain to
+        rock images '''
+    return bytes(terrain >> 4 if terrain & 0x0f == worldfile.Rock else 0 for terrain in range(256))
+
+  def _isCrowded(self, n = 0):
+    ''' Returns True if fewer than a quarter of the cells would be free after
+        filling n more, when trying random cells gets too slow '''
+    return (self._freeCount - n) * 4 < len(self._cells)
+
+  def _listFreeCells(self):
+    self._freeCells = [index for index in range(len(self._cells)) if self._cells[index] == 0]
+    self._freeSlots = dict((index, slot) for slot, index in enumerate(self._freeCells))
+    self._freeCellsShared = False
+
+  def _unshareFreeCells(self):
+    if self._freeCellsShared:
+      self._freeCells = list(self._freeCells)
+      self._freeSlots = dict(self._freeSlots)
+      self._freeCellsShared = False
+
+  def _randomFreeCell(self):
+    while True:
+      index = self._random.randrange(len(self._cells))
 
+      if self._cells[index] == 0:
+        return index
 
   def randomEmptyPos(self):
     ''' Returns random empty position in the world '''
-    pos = None
+    if self._freeCount == 0:
+      raise RuntimeError('There are no empty cells left in the world')
 
-    while True:
-      pos = QPoint(random.randint(0, self.size - 1),
-                   random.randint(0, self.size - 1))
-      if not pos in self.occupiedPositions():
-        break
+    if self._freeCells is None and self._isCrowded():
+      self._listFreeCells()
+
+    if self._freeCells is None:
+      return self._cellPos(self._randomFreeCell())
+
+    return self._cellPos(self._freeCells[self._random.randrange(len(self._freeCells))])
+
+  def randomEmptyPositions(self, n):
+    ''' Returns a list of n distinct random empty positions in the world '''
+    if n > self._freeCount:
+      raise RuntimeError('There are only %d empty cells left in the world' % self._freeCount)
+
+    if self._freeCells is None and self._isCrowded(n):
+      self._listFreeCells()
+
+    if self._freeCells is None:
+      chosen = []
+      chosenSet = set()
+
+      while len(chosen) < n:
+        index = self._randomFreeCell()
+
+        if not index in chosenSet:
+          chosen.append(index)
+          chosenSet.add(index)
+
+      return [self._cellPos(index) for index in chosen]
+
+    return [self._cellPos(index) for index in self._random.sample(self._freeCells, n)]
+
+  def spawn(self, n, monsterClass = None, *args):
+    ''' Places n new objects at distinct random empty positions in a single
+        pass. Random fruits are placed by default, or monsters created as
+        monsterClass(world, *args), e.g. world.spawn(100, DefaultMonster, 1).
+        Returns the list of new objects '''
+    objects = []
+
+    for pos in self.randomEmptyPositions(n):
+      if monsterClass is None:
+        objects.append(self._addFruit(self._randomFruitType(), pos))
+      else:
+        monster = monsterClass(self, *args)
+        self._addMonster(monster, pos)
+        objects.append(monster)
+
+    return objects
+
+  def _cellPos(self, index):
+    return Point(index % self.width, index // self.width)
+
+  def _flagsAt(self, pos):
+    ''' Returns the occupancy grid flags of the cell at the specified position '''
+    return self._cells[pos._y * self.width + pos._x]
+
+  def _setFlag(self, pos, flag):
+    index = pos._y * self.width + pos._x
+
+    if self._cells[index] == 0 and flag != 0:
+      self._freeCount -= 1
+
+      if self._freeCells is not None:
+        self._unshareFreeCells()
+
+        # The cell is no longer free, so move the last free cell into its slot
+        slot = self._freeSlots.pop(index)
+        lastIndex = self._freeCells.pop()
+
+        if lastIndex != index:
+          self._freeCells[slot] = lastIndex
+          self._freeSlots[lastIndex] = slot
 
-    return pos
+    self._cells[index] |= flag
+
+    if flag & Pathfinder._terrainFlags:
+      self._terrainChanged(pos)
+
+  def _clearFlag(self, pos, flag):
+    index = pos._y * self.width + pos._x
+
+    if self._cells[index] != 0:
+      self._cells[index] &= ~flag & 0xFF
+
+      if self._cells[index] == 0:
+        self._freeCount += 1
+
+        if self._freeCells is not None:
+          self._unshareFreeCells()
+          self._freeSlots[index] = len(self._freeCells)
+          self._freeCells.append(index)
+
+    if flag & Pathfinder._terrainFlags:
+      self._terrainChanged(pos)
+
+  def _terrainChanged(self, pos):
+    ''' Updates the neighbour masks of the cells next to pos, the cached
+        paths and the observers after the terrain of pos changed '''
+    index = pos._y * self.width + pos._x
+
+    if self._masksShared:
+      self._neighbourMasks = copy.copy(self._neighbourMasks)
+      self._masksShared = False
+
+    walkBit, swimBit = 0, 0
+    if not self._cells[index] & World._rockFlag:
+      swimBit = 1
+      if not self._cells[index] & World._pondFlag:
+        walkBit = 1
+
+    for direction, vector in World.movingVector.items():
+      neighbour = pos - vector
+
+      if self.rect.contains(neighbour):
+        neighbourIndex = neighbour._y * self.width + neighbour._x
+        bits = (1 << direction) | (1 << direction + 4)
+
+        self._neighbourMasks[neighbourIndex] &= ~bits & 0xFF
+        self._neighbourMasks[neighbourIndex] |= (walkBit << direction) | (swimBit << direction + 4)
+
+    self.pathfinder.terrainChanged(index)
+    self._notify('terrainChanged', pos)
+
+  def addObserver(self, observer):
+    ''' Registers an object to be told about changes in the world. The observer
+        implements objectAdded(obj), objectRemoved(obj), objectChanged(obj),
+        terrainChanged(pos) and monsterSaid(monster, message, seconds) '''
+    self._observers.append(observer)
+
+  def removeObserver(self, observer):
+    self._observers.remove(observer)
+
+  def setSpeechEnabled(self, enabled):
+    ''' Turns the speech of monsters on or off. With speech off say() does
+        nothing, which saves time in runs nobody watches '''
+    self._speechEnabled = enabled
+
+  def _notify(self, event, *args):
+    for observer in self._observers:
+      getattr(observer, event)(*args)
+
+  def objects(self):
+    ''' Returns a list of all the objects in the world, i.e. fruits, monsters
+        and the rubber ring. Terrain is not made of objects, see terrainAt() '''
+    objects = self.fruits + self.monsters
+
+    if self.rubberRing != None:
+      objects.append(self.rubberRing)
+
+    return objects
+
+  def time(self):
+    ''' Returns the simulation time in milliseconds '''
+    return self._scheduler._time
+
+  def frameStats(self):
+    ''' Returns a dictionary with the cost of the last advance() of the clock:
+        the simulated milliseconds, the number of events fired and behaviour
+        turns run, and the real time taken in seconds '''
+    return self._scheduler.frameStats
+
+  def fork(self, behaviours = False):
+    ''' Returns an independent copy of the world, e.g. to try out moves ahead
+        of time. It shares nothing that changes with the world, but has no
+        observers or event log. Monsters in the copy are shallow copies, so
+        attributes of monster classes are shared unless their onCopy() copies
+        them.
+        Unless behaviours is True, the monsters in the copy only do what they
+        are told, e.g. fork.monsters[i].move(World.East), and never get
+        behaviour turns '''
+    world = World.__new__(World)
+    world._observers = []
+    world._eventLog = None
+    world._profiler = None
+    world._workers = None
+    world._copyState(self, dict((monster, copy.copy(monster)) for monster in self.monsters))
+
+    # Drop the methods a Profiler wrapped, which belong to the original monsters
+    for monster in world.monsters:
+      for name in Monster._profiledMethods:
+        monster.__dict__.pop(name, None)
+
+    if not behaviours:
+      world._scheduler.behaviours = False
+      world._scheduler._turns = []
+
+      for monster in world.monsters:
+        monster._turnPending = False
+
+    return world
+
+  def snapshot(self):
+    ''' Returns the state of the simulation, to be passed to restore() '''
+    return self.fork(True)
+
+  def restore(self, snapshot):
+    ''' Puts the simulation back into the state of a snapshot of this world.
+        The monsters stay the same objects; monsters added since the snapshot
+        are removed, and monsters removed since by restoring an earlier
+        snapshot come back as copies. Fruits and the rubber ring are replaced
+        by new objects, and the observers are told about all of it '''
+    oldObjects = self.objects()
+    monsters = {}
+
+    for monster in snapshot.monsters:
+      if monster._index < len(self.monsters):
+        monsters[monster] = self.monsters[monster._index]
+      else:
+        # Removed by restoring an earlier snapshot, so it comes back as a copy
+        monsters[monster] = copy.copy(monster)
 
-  def simulate(self):
-    ''' Begins the simulation process '''
-    # Start the behaviour of the monsters
-    for monster in self.monsters:
-      monster._behaviourTimer.start()
+    self._copyState(snapshot, monsters)
 
-    self.exec_()
+    if self._profiler is not None:
+      for monster in self.monsters:
+        if not monster in oldObjects:
+          self._profiler.monsterAdded(monster)
+
+    newObjects = self.objects()
+
+    for obj in oldObjects:
+      if not obj in newObjects:
+        self._notify('objectRemoved', obj)
+
+    for obj in newObjects:
+      if obj in oldObjects:
+        self._notify('objectChanged', obj)
+      else:
+        self._notify('objectAdded', obj)
+
+    if self._eventLog is not None:
+      self._eventLog.worldRestored()
+
+  def _copyState(self, world, monsters):
+    ''' Makes the simulation state of this world a copy of the state of
+        another one, given a dictionary from its monsters to the monsters to
+        copy them into '''
+    self._random = random.Random()
+    self._random.setstate(world._random.getstate())
+
+    self.filename = world.filename
+    self.width, self.height, self.rect = world.width, world.height, world.rect
+    self.gemSources = world.gemSources
+    self._started = world._started
+    self._speechEnabled = world._speechEnabled
+
+    # Rock images never change, the rest of the grid may. The neighbour masks
+    # only change with the terrain and the free cell index is large, so both
+    # worlds share them until one of them changes its own
+    self._rockTypes = world._rockTypes
+    self._cells = copy.copy(world._cells)
+
+    self._neighbourMasks = world._neighbourMasks
+    self._masksShared = world._masksShared = True
+
+    self._freeCount = world._freeCount
+    self._freeCells = world._freeCells
+    self._freeSlots = world._freeSlots
+    self._freeCellsShared = world._freeCellsShared = world._freeCells is not None
+
+    # Copies of the objects of the other world by the original objects
+    objects = dict(monsters)
+    for fruit in world.fruits:
+      objects[fruit] = copy.copy(fruit)
+    objects[world.rubberRing] = copy.copy(world.rubberRing)
+
+    self._scheduler, events = world._scheduler._copy(self, objects)
+
+    self.fruits = [objects[fruit] for fruit in world.fruits]
+    self.monsters = [objects[monster] for monster in world.monsters]
+    self.rubberRing = objects[world.rubberRing]
+
+    for original, obj in objects.items():
+      obj._copyState(original, self, objects, events)
+
+    self._fruitCells = dict((index, objects[fruit]) for index, fruit in world._fruitCells.items())
+    self._fruitBuckets = dict((bucket, [objects[fruit] for fruit in fruits])
+                              for bucket, fruits in world._fruitBuckets.items())
+
+    self.pathfinder = Pathfinder(self)
+    self.pathfinder._copyFields(world.pathfinder)
+
+  def start(self):
+    ''' Gives control to the monsters. Called by simulate() and run() '''
+    if not self._started:
+      self._started = True
+
+      for monster in self.monsters:
+        self._scheduler.requestTurn(monster)
+
+  def advance(self, milliseconds):
+    ''' Advances the simulation clock by the specified number of milliseconds,
+        running everything which becomes due in the meantime '''
+    self._scheduler.advance(milliseconds)
+
+  def tick(self):
+    ''' Advances the simulation clock by one tick '''
+    self.advance(World.tickLength)
+
+  def run(self, ticks):
+    ''' Runs the simulation without a window for the specified number of ticks '''
+    self.start()
+    self.advance(ticks * World.tickLength)
+
+  def simulate(self, timeScale = 1):
+    ''' Begins the simulation process in a window. The world runs timeScale
+        times faster than real time, or as fast as possible if timeScale is None '''
+    from views import WorldView
+
+    view = WorldView(self)
+    view.setTimeScale(timeScale)
+
+    self.start()
+
+    view.exec_()
 
 
   def occupiedPositions(self):
@@ -124,34 +743,72 @@ class World(QApplication):
 
   def obstaclePositions(self):
     ''' Returns a list of cell positions where monster can not go '''
-    return (self.rockPositions() + self.monsterPositions() 
+    return (self.rockPositions() + self.monsterPositions()
            + self.monsterTargets() + self.pondPositions())
 
   def fruitPositions(self):
-    ''' Returns a list of QPoints of cell positions containing fruit '''
+    ''' Returns a list of Points of cell positions containing fruit '''
     return [fruit._pos for fruit in self.fruits]
 
+  def _flagPositions(self, flag):
+    ''' Returns the positions of the cells with an occupancy grid flag set.
+        The grid is turned into one byte per cell, 1 where the flag is set,
+        and searched with bytes.find() instead of visiting the cells one by
+        one. A world kept in chunks has to read every chunk for it, so on
+        large worlds this is slow and only kept for compatibility '''
+    table = bytes(1 if flags & flag else 0 for flags in range(256))
+
+    if isinstance(self._cells, bytearray):
+      cells = self._cells.translate(table)
+    else:
+      cells = bytes(self._cells).translate(table)
+
+    positions = []
+    index = cells.find(1)
+
+    while index != -1:
+      positions.append(self._cellPos(index))
+      index = cells.find(1, index + 1)
+
+    return positions
+
   def rockPositions(self):
-    ''' Returns a list of QPoints of cell positions containing rock '''
-    return [fruit._pos for fruit in self.rocks]
+    ''' Returns a list of Points of cell positions containing rock '''
+    return self._flagPositions(World._rockFlag)
 
   def pondPositions(self):
-    return [pond._pos for pond in self.ponds]
+    ''' Returns a list of Points of cell positions containing pond '''
+    return self._flagPositions(World._pondFlag)
+
+  def terrainAt(self, pos):
+    ''' Returns the terrain in the cell at pos: World.Rock, World.Pond or World.Grass '''
+    flags = self._flagsAt(pos)
+
+    if flags & World._rockFlag:
+      return World.Rock
+    elif flags & World._pondFlag:
+      return World.Pond
+    else:
+      return World.Grass
 
   def monsterPositions(self):
-    ''' Returns a list of QPoints of cell positions containing moster '''
+    ''' Returns a list of Points of cell positions containing moster '''
     return [fruit._pos for fruit in self.monsters]
 
   def monsterTargets(self):
-    ''' Returns a list of QPoints of cell positions where some of the monster
+    ''' Returns a list of Points of cell positions where some of the monster
         want to go '''
     return [monster._targetPos for monster in self.monsters if monster._targetPos is not None]
 
   def addRandomFruit(self):
     ''' Places random fruit at the random place in the world '''
+    return self._addFruit(self._randomFruitType(), self.randomEmptyPos())
+
+  def _randomFruitType(self):
+    ''' Returns the type of a fruit to place, chosen by the fruit probabilities '''
 
     # Get random float from 0.0 to 1.0
-    randomNumber = random.random()
+    randomNumber = self._random.random()
 
     # Choose which fruit type should be placed. We want certain types of fruit to apper less.
     # In order to do it, we split range [0,1] into sectors. For each fruit type the size of its
@@ -164,23 +821,66 @@ class World(QApplication):
 
       # If the number is in this sector, use this type of fruit
       if randomNumber <= previousSum:
-        fruitTypeToPlace = fruitType
-        break
+        return fruitType
 
-    fruit = Fruit(fruitTypeToPlace, self)
-    fruit._setRandomPos()
+  def _addFruit(self, fruitType, pos):
+    fruit = Fruit(fruitType, self)
+    fruit._setPos(pos)
 
     # Place fruit
     self.fruits.append(fruit)
 
+    self._fruitCells[pos._y * self.width + pos._x] = fruit
+    self._fruitBuckets.setdefault(self._fruitBucket(pos), []).append(fruit)
+
+    self._notify('objectAdded', fruit)
+
+    if self._eventLog is not None:
+      self._eventLog.fruitAdded(fruit)
+
+    return fruit
+
+  def _removeFruit(self, fruit):
+    pos = fruit._pos
+
+    self.fruits.remove(fruit)
+    self._clearFlag(pos, World._fruitFlag)
+
+    del self._fruitCells[pos._y * self.width + pos._x]
+    bucket = self._fruitBuckets[self._fruitBucket(pos)]
+    bucket.remove(fruit)
+
+    if len(bucket) == 0:
+      del self._fruitBuckets[self._fruitBucket(pos)]
+
+  def _fruitBucket(self, pos):
+    return (pos._x // World._fruitBucketSize, pos._y // World._fruitBucketSize)
+
   def getFruitAtPos(self, pos):
     ''' Returns fruit object located at the specified position, or None '''
-    for fruit in self.fruits:
-      if fruit._pos == pos and fruit._isVanished == False:
-        return fruit
+    fruit = self._fruitCells.get(pos._y * self.width + pos._x)
+
+    if fruit != None and fruit._isVanished == False:
+      return fruit
 
     return None
 
+  def fruitsNear(self, pos, distance):
+    ''' Returns a list of the fruits within the specified Manhattan distance
+        of a position. Only the buckets overlapping that area are searched '''
+    fruits = []
+
+    firstBucketX, firstBucketY = self._fruitBucket(pos - Point(distance, distance))
+    lastBucketX, lastBucketY = self._fruitBucket(pos + Point(distance, distance))
+
+    for bucketY in range(firstBucketY, lastBucketY + 1):
+      for bucketX in range(firstBucketX, lastBucketX + 1):
+        for fruit in self._fruitBuckets.get((bucketX, bucketY), ()):
+          if abs(fruit._pos._x - pos._x) + abs(fruit._pos._y - pos._y) <= distance:
+            fruits.append(fruit)
+
+    return fruits
+
   def getItemAtPos(self, pos):
     ''' Returns item object located at the specified position, or None '''
     if self.rubberRing._pos == pos and self.rubberRing._isVanished == False:
@@ -188,53 +888,385 @@ class World(QApplication):
 
   def addMonster(self, monster):
     ''' Adds a new monster to the list '''
+    self._addMonster(monster, self.randomEmptyPos())
+
+  def _addMonster(self, monster, pos):
+    monster._index = len(self.monsters)
     self.monsters.append(monster)
-    monster._setRandomPos()
+    monster._setPos(pos)
 
-class WorldObject(QWidget):
-  def __init__(self, world, image, z, position = None):
-    super(WorldObject, self).__init__()
+    self._notify('objectAdded', monster)
+
+    if self._eventLog is not None:
+      self._eventLog.monsterAdded(monster)
+
+    if self._profiler is not None:
+      self._profiler.monsterAdded(monster)
+
+    heldSpeech, monster._heldSpeech = monster._heldSpeech, []
+    for message, seconds in heldSpeech:
+      monster.say(message, seconds)
+
+    if self._started:
+      self._scheduler.requestTurn(monster)
+
+class _SparseDistances(dict):
+  ''' Distances by cell index for the fields of large worlds, which only hold
+      the cells searched so far; the others read as -1 '''
+
+  def __missing__(self, index):
+    return -1
+
+class DistanceField(object):
+  ''' Numbers of moves from the cells of a world to a target cell, searched
+      breadth-first from the target only as far as the cells asked for '''
+
+  def __init__(self, world, target, swimming):
+    self._world = world
+    self._swimming = swimming
 
+    # Distance by cell index, -1 where the search did not get yet or can not
+    # get. Large worlds keep only the cells searched, so it stays in the
+    # chunks around the target
+    if isinstance(world._cells, bytearray):
+      self._distances = array.array('i', [-1]) * len(world._cells)
+    else:
+      self._distances = _SparseDistances()
+
+    # Cells at the current distance from the target, whose neighbours are
+    # searched next
+    self._frontier = []
+    self._distance = 0
+
+    blocked = World._rockFlag
+    if not swimming:
+      blocked |= World._pondFlag
+
+    if not world._cells[target] & blocked:
+      self._distances[target] = 0
+      self._frontier.append(target)
+
+  def get(self, index, search = True):
+    ''' Returns the number of moves from the cell with given index to the
+        target, or -1 if the target can not be reached from it. If search is
+        False, cells the search did not get to so far read as -1 too '''
+    distances = self._distances
+
+    while search and distances[index] == -1 and len(self._frontier) != 0:
+      self._searchFurther()
+
+    return distances[index]
+
+  def isComplete(self):
+    return len(self._frontier) == 0
+
+  def size(self):
+    ''' Returns the number of cells the field holds '''
+    return len(self._distances)
+
+  def _searchFurther(self):
+    ''' Finds the cells one move further from the target '''
+    masks = self._world._neighbourMasks
+    width = self._world.width
+    distances = self._distances
+
+    # Neighbour mask bits of the directions and the index offsets they lead to
+    offsets = [(1 << direction + (4 if self._swimming else 0), offset) for direction, offset
+               in [(World.North, -width), (World.South, width), (World.East, 1), (World.West, -1)]]
+
+    self._distance += 1
+    distance = self._distance
+    frontier = []
+
+    for index in self._frontier:
+      mask = masks[index]
+
+      for bit, offset in offsets:
+        if mask & bit and distances[index + offset] == -1:
+          distances[index + offset] = distance
+          frontier.append(index + offset)
+
+    self._frontier = frontier
+
+    if len(frontier) == 0:
+      # Complete fields never search again, so they can be shared by copies
+      # of the world without keeping this one alive
+      self._world = None
+
+class Pathfinder(object):
+  ''' Shortest paths over the terrain of a world. Breadth-first distance fields
+      towards a target cell are cached, so every monster heading for the same
+      cell shares one search. Monsters are not obstacles here: they move on
+      every tick and would invalidate every field, so they are only avoided
+      when choosing the next step '''
+
+  # Occupancy grid layers which block paths
+  _terrainFlags = World._rockFlag | World._pondFlag
+
+  # Maximum number of cells held by all the distance fields in the cache,
+  # 64 MB worth of fields of four bytes per cell
+  cacheCells = 1 << 24
+
+  def __init__(self, world):
     self._world = world
-    self._pos = QPoint(0,0)
+
+    # Distance fields by (target cell index, swimming), least recently used first
+    self._fields = OrderedDict()
+
+  def distanceField(self, target, swimming):
+    ''' Returns the DistanceField towards the target position, whose
+        get(index) gives the number of moves from the cell with that index to
+        the target, or -1 if the target can not be reached from it. Ponds are
+        passable if swimming is True '''
+    key = (target._y * self._world.width + target._x, swimming)
+    field = self._fields.pop(key, None)
+
+    if field is None:
+      field = DistanceField(self._world, key[0], swimming)
+      cells = sum(cached.size() for cached in self._fields.values()) + field.size()
+
+      while len(self._fields) != 0 and cells > Pathfinder.cacheCells:
+        cells -= self._fields.popitem(last = False)[1].size()
+
+    self._fields[key] = field
+
+    return field
+
+  def _copyFields(self, pathfinder):
+    ''' Shares the complete fields of another pathfinder, for a copy of its
+        world. The others would go on searching the terrain of either world '''
+    self._fields = OrderedDict((key, field) for key, field in pathfinder._fields.items()
+                               if field.isComplete())
+
+  def _neighbours(self, index, width, count):
+    ''' Returns the indices of the cells next to the cell with given index '''
+    neighbours = []
+
+    if index >= width:
+      neighbours.append(index - width)
+    if index + width < count:
+      neighbours.append(index + width)
+    if index % width != 0:
+      neighbours.append(index - 1)
+    if index % width != width - 1:
+      neighbours.append(index + 1)
+
+    return neighbours
+
+  def terrainChanged(self, index):
+    ''' Drops the cached fields which a change of the terrain in the cell with
+        given index can affect, i.e. the ones reaching that cell or its
+        neighbours. Fields which did not get there yet find the new terrain
+        when they search further '''
+    cells = [index] + self._neighbours(index, self._world.width, len(self._world._cells))
+
+    for key, field in list(self._fields.items()):
+      if any(field.get(cell, False) != -1 for cell in cells):
+        del self._fields[key]
+
+class KnowledgeMap(object):
+  ''' What a monster has found out about the cells of its world, for monster
+      creators whose monsters learn the terrain as they go. Each cell takes a
+      byte, so the map of even a large world is small and reading or writing
+      a cell is cheap:
+
+        self.known = KnowledgeMap(self.worldRect().width(), self.worldRect().height())
+        self.known[self.pos() + World.movingVector[World.East]] = KnowledgeMap.Free
+
+      Cells outside the map read as Blocked, and writing them does nothing '''
+
+  # What is known about a cell
+  Unknown, Free, Blocked = range(3)
+
+  # Tables for bytes.translate() turning the Unknown cells, and the Free
+  # cells, into 1 and every other cell into 0
+  _unknownTable = b'\x01' + bytes(255)
+  _freeTable = b'\x00\x01' + bytes(254)
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+
+    # What is known about each cell, by index y * width + x
+    self.cells = bytearray(width * height)
+
+    # Result of the last distances() search, allocated by the first one, and
+    # the indices of the cells it reached, the only ones to reset next time
+    self._distances = None
+    self._reached = []
+
+  def __copy__(self):
+    knowledge = KnowledgeMap(self.width, self.height)
+    knowledge.cells[:] = self.cells
+    return knowledge
+
+  def get(self, pos):
+    ''' Returns what is known about the cell at the specified position '''
+    if 0 <= pos._x < self.width and 0 <= pos._y < self.height:
+      return self.cells[pos._y * self.width + pos._x]
+
+    return KnowledgeMap.Blocked
+
+  def set(self, pos, value):
+    ''' Records what is known about the cell at the specified position '''
+    if 0 <= pos._x < self.width and 0 <= pos._y < self.height:
+      self.cells[pos._y * self.width + pos._x] = value
+
+  __getitem__ = get
+  __setitem__ = set
+
+  def frontier(self):
+    ''' Returns the positions of the Free cells next to at least one Unknown
+        cell, in row order. Like worldfile.computeMasks(), it shifts whole
+        rows of cells as big integers rather than visiting the cells one by one '''
+    width = self.width
+    count = len(self.cells)
+
+    unknown = int.from_bytes(self.cells.translate(KnowledgeMap._unknownTable), 'little')
+    free = int.from_bytes(self.cells.translate(KnowledgeMap._freeTable), 'little')
+
+    # Cells which have a neighbour to the east and to the west
+    notLastColumn = int.from_bytes((b'\x01' * (width - 1) + b'\x00') * self.height, 'little')
+    notFirstColumn = int.from_bytes((b'\x00' + b'\x01' * (width - 1)) * self.height, 'little')
+
+    # Byte i is 1 if cell i has an Unknown neighbour to the north, south,
+    # east or west
+    nearUnknown = ((unknown << 8 * width) | (unknown >> 8 * width) |
+                   ((unknown >> 8) & notLastColumn) | ((unknown << 8) & notFirstColumn))
+
+    frontier = (nearUnknown & free).to_bytes(count, 'little')
+
+    positions = []
+    index = frontier.find(1)
+
+    while index != -1:
+      positions.append(Point(index % width, index // width))
+      index = frontier.find(1, index + 1)
+
+    return positions
+
+  def distances(self, start):
+    ''' Searches the Free cells breadth-first from the start position, which
+        counts as Free whatever is known about it. Returns an array holding,
+        for each cell index y * width + x, the number of moves from start to
+        that cell, or -1 if it can not be reached through Free cells. The
+        array is reused, so the next search overwrites it '''
+    width = self.width
+    count = len(self.cells)
+    cells = self.cells
+    free = KnowledgeMap.Free
+
+    if self._distances is None:
+      self._distances = array.array('i', [-1]) * count
+
+    distances = self._distances
+
+    for index in self._reached:
+      distances[index] = -1
+
+    startIndex = start._y * width + start._x
+    distances[startIndex] = 0
+
+    reached = [startIndex]
+    frontier = [startIndex]
+    distance = 0
+
+    while len(frontier) != 0:
+      distance += 1
+      nextFrontier = []
+
+      for index in frontier:
+        column = index % width
+
+        for neighbour, exists in ((index - width, index >= width), (index + width, index + width < count),
+                                  (index + 1, column != width - 1), (index - 1, column != 0)):
+          if exists and cells[neighbour] == free and distances[neighbour] == -1:
+            distances[neighbour] = distance
+            nextFrontier.append(neighbour)
+
+      reached.extend(nextFrontier)
+      frontier = nextFrontier
+
+    self._reached = reached
+    return distances
+
+  def distance(self, pos):
+    ''' Returns the number of moves to the specified position found by the
+        last distances() search, or -1 '''
+    if self._distances is None or not (0 <= pos._x < self.width and 0 <= pos._y < self.height):
+      return -1
+
+    return self._distances[pos._y * self.width + pos._x]
+
+class WorldObject(object):
+
+  # Objects only hold a handful of values, so save the memory of a __dict__
+  __slots__ = ('_world', '_pos', '_placed', '_image', '_z')
+
+  # Layer of the occupancy grid kept up to date by _setPos()
+  _cellFlag = 0
+
+  def __init__(self, world, image, z, position = None):
+    self._world = world
+    self._pos = Point(0,0)
+
+    # Whether the object has been placed on the occupancy grid
+    self._placed = False
 
     if position != None:
       self._pos = position
 
-    scaledPixmap = QPixmap(image).scaled(World.cellSize, World.cellSize, mode = Qt.SmoothTransformation)
-    self._graphicsItem = QGraphicsPixmapItem(scaledPixmap)
-    self._graphicsItem.setPos(self._pos * World.cellSize) 
-    self._graphicsItem.setTransformOriginPoint(self._graphicsItem.boundingRect().center()) 
-    self._graphicsItem.setZValue(z)
-
-    self._world.scene.addItem(self._graphicsItem)
+    # Appearance, used by the views showing the world
+    self._image = image
+    self._z = z
 
   def _setPos(self, newPos):
+    placed = self._placed
+
+    if placed:
+      self._world._clearFlag(self._pos, self._cellFlag)
+
     self._pos = newPos
-    self._graphicsItem.setPos(newPos * World.cellSize)
+    self._placed = True
+    self._world._setFlag(newPos, self._cellFlag)
 
-  def _setRandomPos(self): 
+    # The world tells the observers about an object once it is placed the
+    # first time and fully set up, with objectAdded
+    if placed:
+      self._world._notify('objectChanged', self)
+
+  def _setRandomPos(self):
     self._setPos(self._world.randomEmptyPos())
 
-  def __del__(self):
-    self._world.scene.removeItem(self._graphicsItem)
+  def _copyState(self, original, world, objects, events):
+    ''' Takes over the state of the original object for a copy of its world.
+        objects and events map the objects and scheduler events of the
+        original world to their copies '''
+    self._world = world
+
+    for name in WorldObject.__slots__[1:]:
+      setattr(self, name, getattr(original, name))
 
 class PickableWorldObject(WorldObject):
+
+  __slots__ = ('_animationEvent', '_animation', '_animationStart', '_isVanished')
+
+  # Enumeration for the animations of pickable objects
+  Appearing, Vanishing = range(2)
+
+  # Length of the appearing and vanishing animations, in milliseconds
+  _animationDuration = 100
+
   def __init__(self, world, image, position = None):
     super(PickableWorldObject, self).__init__(world, image, 1, position)
 
-     # Timer for animating the vanishing process      
-    self._vanishTimer = QTimer()
-    self._vanishTimer.setInterval(10)
-    self._vanishTimer.timeout.connect(self._vanishStep)
+    # Event ending the appearing or vanishing process. The animation itself is
+    # left to the views, which interpolate it from the simulation time
+    self._animationEvent = None
 
-    # Timer for animating the appearing process
-    self._appearTimer = QTimer()
-    self._appearTimer.setInterval(10)
-    self._appearTimer.timeout.connect(self._appearStep)
-    
-    # Position along the animation timeline, between 0.0 and 1.0
-    self._animationStep = 0.0
+    # Animation in progress, or None, and the simulation time it started at
+    self._animation = None
+    self._animationStart = 0
 
     # Variable to avoid picking object one more time while it is in the process
     # of vanishing
@@ -245,80 +1277,79 @@ class PickableWorldObject(WorldObject):
 
   def vanish(self):
     ''' Start the vanishing process '''
-    self._animationStep = 0.0
-    self._vanishTimer.start()
+    self._startAnimation(PickableWorldObject.Vanishing)
 
     # Mark item as vanished so it could not be used again
     self._isVanished = True
-  
-  def _vanishStep(self):
-    ''' Step the vanishing animation along by one '''
-    self._animationStep +=  0.1
-    self._graphicsItem.setScale(1.0 - self._animationStep)
-    self._graphicsItem.setOpacity(1.0 - self._animationStep)
-    
-    if (self._animationStep >= 1.0):
-      self._vanishTimer.stop()
-      self._graphicsItem.setScale(1.0)
-      # Run a callback
-      self._vanishFinished()
 
-    self._world.scene.update()
-    
   def appear(self):
     ''' Start the appearing process '''
-    self._animationStep = 0.0
-    self._graphicsItem.setScale(0.1)
-    self._graphicsItem.setOpacity(0.1)
-    self._appearTimer.start()
-    self._world.scene.update()
+    self._startAnimation(PickableWorldObject.Appearing)
 
     # Mark item as active, so it can be used again
     self._isVanished = False
 
-  def _appearStep(self):
-    ''' Step the appearing animation along by one '''
-    self._animationStep += 0.1
-    self._graphicsItem.setScale(self._animationStep)
-    self._graphicsItem.setOpacity(self._animationStep)
-    
-    if (self._animationStep >= 1.0):
-      self._appearTimer.stop()
-      self._graphicsItem.setScale(1.0)
-      self._graphicsItem.setOpacity(1.0)
-    
-    self._world.scene.update()
+  def _startAnimation(self, animation):
+    self._animation = animation
+    self._animationStart = self._world.time()
+
+    self._world._scheduler.cancel(self._animationEvent)
+    self._animationEvent = self._world._scheduler.schedule(PickableWorldObject._animationDuration,
+                                                           self._animationFinished)
+
+    if self._placed:
+      self._world._notify('objectChanged', self)
+
+  def _animationFinished(self):
+    animation = self._animation
+    self._animation = None
+    self._world._notify('objectChanged', self)
+
+    if animation == PickableWorldObject.Vanishing:
+      # Run a callback
+      self._vanishFinished()
 
   def _vanishFinished(self):
     ''' Callback function. Called, when vanishing process is finished.
         To be implemented in subclasses as necessary '''
     pass
 
-class Rock(WorldObject):
+  def _copyState(self, original, world, objects, events):
+    super(PickableWorldObject, self)._copyState(original, world, objects, events)
 
-  def __init__(self, rockType, world, position = None):
-    super(Rock, self).__init__(world, './images/boulder%d.png' % rockType, 1, position)
+    self._animationEvent = events.get(id(original._animationEvent))
+    self._animation = original._animation
+    self._animationStart = original._animationStart
+    self._isVanished = original._isVanished
 
-class Pond(WorldObject):
+class RubberRing(PickableWorldObject):
 
-  def __init__(self, world, position = None):
-    super(Pond, self).__init__(world, './images/pond.png', 1, position)
+  __slots__ = ('_ownerLeaveEvent', '_owner')
 
-class RubberRing(PickableWorldObject):
+  _cellFlag = World._itemFlag
+
+  # Time a monster keeps the ring for, in milliseconds
+  _ownershipTime = 5000
 
   def __init__(self, world, position = None):
     super(RubberRing, self).__init__(world, './images/rubber_ring.png', position)
 
-    self._ownerLeaveTimer = QTimer()
-    self._ownerLeaveTimer.setSingleShot(True)
-    self._ownerLeaveTimer.setInterval(5000)
-    self._ownerLeaveTimer.timeout.connect(self._leaveOwner)
+    # Event taking the ring away from its owner
+    self._ownerLeaveEvent = None
 
     self._owner = None
 
+  def _copyState(self, original, world, objects, events):
+    super(RubberRing, self)._copyState(original, world, objects, events)
+
+    self._ownerLeaveEvent = events.get(id(original._ownerLeaveEvent))
+    self._owner = objects.get(original._owner)
+
   def setOwner(self, owner):
     self._owner = owner
-    self._ownerLeaveTimer.start()
+
+    self._world._scheduler.cancel(self._ownerLeaveEvent)
+    self._ownerLeaveEvent = self._world._scheduler.schedule(RubberRing._ownershipTime, self._leaveOwner)
 
   def _leaveOwner(self):
     self._owner._items.remove(self)
@@ -329,6 +1360,9 @@ class RubberRing(PickableWorldObject):
     self._setRandomPos()
     self.appear()
 
+    if self._world._eventLog is not None:
+      self._world._eventLog.ringLost(self)
+
 class Fruit(PickableWorldObject):
 
   # Energy amount for each type of fruit
@@ -343,6 +1377,10 @@ class Fruit(PickableWorldObject):
                        3 : 0.2,
                        4 : 0.1}
 
+  __slots__ = ('_type',)
+
+  _cellFlag = World._fruitFlag
+
   def __init__(self, fruitType, world, position = None):
     super(Fruit, self).__init__(world,'./images/fruit%d.png' % fruitType, position)
 
@@ -352,151 +1390,74 @@ class Fruit(PickableWorldObject):
   def type(self):
     return self._type
 
-  def _vanishFinished(self):
-    # Remove fruit from the world
-    self._world.fruits.remove(self)
+  def _copyState(self, original, world, objects, events):
+    super(Fruit, self)._copyState(original, world, objects, events)
 
+    self._type = original._type
 
-class SpeechBubble:
-  textMargin = 10
-
-  arrowWidth = 10
-  arrowHeight = 10
-  arrowPosition = 40
-
-  def __init__(self, world):
-    self._world = world
-
-    # Font used
-    self._font = QFont("arial", 10)
-    # Font metrics for determining the size of the message
-    self._fm = QFontMetrics(self._font)
-
-    # Timer to hide bubble after some time
-    self._hideTimer = QTimer()
-    self._hideTimer.setSingleShot(True)
-    self._hideTimer.timeout.connect(self.hide)
+  def _vanishFinished(self):
+    # Remove fruit from the world
+    self._world._removeFruit(self)
+    self._world._notify('objectRemoved', self)
 
-    # Create graphics item for the bubble
-    self._graphicsItem = QGraphicsPixmapItem()
-    self._graphicsItem.setZValue(100)
 
-    self._world.scene.addItem(self._graphicsItem)
+class Senses(namedtuple('Senses', ['pos', 'energy', 'surroundings', 'passable', 'onFruit', 'onItem',
+                                   'smell', 'items'])):
+  ''' What a monster senses, returned by Monster.sense(). surroundings and
+      passable are indexed by direction, and hold what observe() and
+      canMove() tell in that direction. smell is a tuple of (fruitPosition,
+      fruitType) like smell() returns '''
 
-  def setMessage(self, message):
-    # Crop the string to the allowed length
-    message = message[:140]
+  __slots__ = ()
 
-    # Determine the size of message
-    textWidth = self._fm.width(message)
-    textHeight = self._fm.height()
+  def observe(self, direction):
+    return self.surroundings[direction]
 
-    # If message is long, split it into two lines
-    if len(message) > 70:
-      bubbleWidth = self._fm.width(message[:70]) + SpeechBubble.textMargin * 2
-      bubbleHeight = self._fm.height() * 2 + SpeechBubble.textMargin * 2
-    else:
-      bubbleWidth = textWidth + SpeechBubble.textMargin * 2
-      bubbleHeight = textHeight + SpeechBubble.textMargin * 2
-
-    # Create pixmap to draw on
-    bubble = QPixmap(bubbleWidth, bubbleHeight + SpeechBubble.arrowHeight)
-    bubble.fill(Qt.transparent)
-
-    bubblPath = QPainterPath()
-    # Create bubble box
-    bubblPath.addRoundRect(QRectF(1,1,bubbleWidth - 2,bubbleHeight - 2), 10, 30)
-    # Create arrow
-    bubblPath.moveTo(QPointF(SpeechBubble.arrowPosition, bubbleHeight - 1))
-    bubblPath.lineTo(QPointF(SpeechBubble.arrowPosition + SpeechBubble.arrowWidth / 2, 
-                              bubbleHeight + SpeechBubble.arrowHeight))
-    bubblPath.lineTo(QPointF(SpeechBubble.arrowPosition + SpeechBubble.arrowWidth, bubbleHeight - 1))
-    # Merge arrow with bubble box
-    bubblPath = bubblPath.simplified()
-
-    # Draw bubble
-    bubblePainter = QPainter(bubble)
-    bubblePainter.setRenderHint(QPainter.Antialiasing)
-    bubblePainter.setBrush(QBrush(Qt.white))
-    bubblePainter.setPen(Qt.black)
-    bubblePainter.setOpacity(0.7)
-    bubblePainter.drawPath(bubblPath)
-
-    # Draw text on bubble
-    bubblePainter.setRenderHint(QPainter.TextAntialiasing)
-    bubblePainter.setOpacity(1)
-    bubblePainter.setFont(self._font)
-    bubblePainter.drawText(QRectF(self.textMargin, self.textMargin, bubbleWidth, bubbleHeight), 
-                           Qt.TextWordWrap | Qt.AlignTop, message)
-
-    del bubblePainter
-
-    self._graphicsItem.setPixmap(bubble)
-
-  def setPos(self, x, y):
-    ''' Set the position of this speech bubble in that way that x and y are the coords of
-        the arrow '''
-    newX = x - SpeechBubble.arrowPosition - SpeechBubble.arrowWidth / 2
-    newY = y - self._graphicsItem.boundingRect().height() - SpeechBubble.arrowHeight
-
-    self._graphicsItem.setPos(newX, newY);
-
-  def show(self, seconds = None):
-    ''' Show the bubble for specified number of seconds, or forever if seconds is None '''
-    if seconds != None:
-      # Start a timer to hide the bubble after specified time
-      self._hideTimer.start(seconds * 1000)
-
-    self._graphicsItem.show()
-
-  def hide(self):
-    self._graphicsItem.hide()
+  def canMove(self, direction):
+    return self.passable[direction]
 
 class Monster(WorldObject):
 
+  _cellFlag = World._monsterFlag
+
   _energyPenaltyOccupied = 5
   _energyPerMove = 1
   _energyCriticalLevel = 10
   _energyMax = 50
   _energyPerSecond = 10
 
+  # Maximum Manhattan distance at which a monster can smell fruit
+  _smellDistance = 15
+
+  # Time a move takes at normal speed, in milliseconds
+  _moveDuration = 200
+
   def __init__(self, world, monsterType, position = None):
     image = './images/monster%d.png' % monsterType
 
     super(Monster, self).__init__(world, image, 2, position)
-    
+
     self._speed = 1.0
-    self._t = 0.0 # Animation parameter
-    
-    # Variables to control the 'wobble' of a monster as it moves
-    self._wobbleCount = 0
-    self._wobbleDirection = 1
 
-    # The cell to which a monster is about to move
+    # The cell to which a monster is about to move, and the simulation time
+    # and duration of the move. Views animate the move from these
     self._targetPos = None
-    
-    # Timer for controlling the move animation
-    self._moveTimer = QTimer(self)
-    self._moveTimer.timeout.connect(self._updatePosition)
-    
-    # A 0-time timer to allow behaviour to be controlled by a slot rather than
-    # called directly as a function
-    self._behaviourTimer = QTimer(self)
-    self._behaviourTimer.setInterval(0)
-    self._behaviourTimer.setSingleShot(True)
-    self._behaviourTimer.timeout.connect(self.behaviour)
-
-    # Speech bubble with the message monster is currently saying
-    self._speechBubble = SpeechBubble(self._world)
-    self._updateSpeechBubblePos()
+    self._moveStart = 0
+    self._moveLength = 0
+
+    # Position in the world's list of monsters, used to take behaviour turns
+    # in round-robin order, and whether the monster is waiting for a turn
+    self._index = 0
+    self._turnPending = False
 
     # Variable to store energy of the monster
     self._energy = Monster._energyMax
 
-    # Timer to control sleeping
-    self._sleepTimer = QTimer(self)
-    self._sleepTimer.setInterval(1000)
-    self._sleepTimer.timeout.connect(self._sleep)
+    # What the monster senses in its current turn, see sense()
+    self._senses = None
+
+    # Event of the next second of sleep
+    self._sleepEvent = None
 
     # Variables to control sleeping
     self._isSleeping = False
@@ -505,62 +1466,44 @@ class Monster(WorldObject):
     # List of items monster has (accesible by monster author)
     self._items = []
 
+    # Messages said before the monster was added to the world, e.g. in
+    # onCreate(), as tuples (message, seconds). They are said once it is added
+    self._heldSpeech = []
+
+    # Counters reported by statistics()
+    self._fruitEaten = 0
+    self._moves = 0
+    self._sleepTime = 0
+
     self.onCreate() # Callback
 
-  @Slot()
-  def _updatePosition(self):
-    ''' Update the position of the monster if we are in the process of movement '''
-    
-    # Step the animation parameter on a bit
-    self._t += 0.05
-
-    # Arrange for the monster to wobble as it moves
-    self._wobbleCount += 1
-    self._graphicsItem.setRotation(self._wobbleCount * self._wobbleDirection)
-    if (self._wobbleCount > 4):
-      self._wobbleDirection *= -1
-      self._wobbleCount = 0
-      
-    # Calculate the new position
-    newPos = QPointF(self._pos) + QPointF(self._targetPos - self._pos) * self._t
-
-    self._graphicsItem.setPos(newPos * World.cellSize)
-
-    # Move the speech bubble together with the monster
-    self._updateSpeechBubblePos()
-    
-    # Redraw the field
-    self._world.scene.update()
-    
-    # if the animation is complete, reset everything ready for the next move
-    if self._t >= 1.0:
-      self._moveTimer.stop() 
-      self._setPos(self._targetPos)
-      self._targetPos = None
-      self._behaviourTimer.start()
-
-  def _updateSpeechBubblePos(self):
-    ''' Update speech bubble position so it is right above the monster '''
-
-    if self._speechBubble != None:
-      monsterWidth = self._graphicsItem.boundingRect().width()
-      monsterX = self._graphicsItem.x()
-      monsterY = self._graphicsItem.y()
-
-      self._speechBubble.setPos(monsterX + monsterWidth / 2, monsterY);
+  def _finishMove(self):
+    ''' Put the monster into the target cell once the move is over '''
+    self._world._clearFlag(self._targetPos, World._targetFlag)
+    self._setPos(self._targetPos)
+    self._targetPos = None
+    self._world._scheduler.requestTurn(self)
 
   def _increaseEnergy(self, amount):
     # Increase energy to the maximum of energyMax
     self._energy = min((self._energy + amount), Monster._energyMax)
-    
+    self._senses = None
+
+    if self._world._eventLog is not None:
+      self._world._eventLog.energyChanged(self)
+
     if self._speed < 1.0 and self._energy > Monster._energyCriticalLevel:
       # If we were low on energy, and regained it, return to the normal speed
       self._speed = 1.0
-    
+
 
   def _reduceEnergy(self, amount):
     # Reduce energy to the minimum of 0
     self._energy = max((self._energy - amount), 0);
+    self._senses = None
+
+    if self._world._eventLog is not None:
+      self._world._eventLog.energyChanged(self)
 
     if self._energy == 0:
       # If have no energy, go to sleep for the period necessary to restore it
@@ -572,18 +1515,96 @@ class Monster(WorldObject):
       self._speed = 0.3
       self.say("Low on energy")
 
+  def _takeTurn(self):
+    ''' Runs a behaviour turn of the monster '''
+    scheduler = self._world._scheduler
+    self._turnPending = False
+    self._senses = None
+
+    scheduler._turnOwner = self
+    try:
+      self.behaviour()
+    finally:
+      scheduler._turnOwner = None
+
+  def _missTurn(self):
+    ''' Lets the time of one move pass before the next behaviour turn '''
+    self._world._scheduler.schedule(Monster._moveDuration, self._requestTurn)
+
+  def _requestTurn(self):
+    self._world._scheduler.requestTurn(self)
+
   def _sleep(self):
     if self._isSleeping:
+      self._sleepTime += 1000
+
       if self._leftSleeping > 0:
         self._leftSleeping -= 1
         self._increaseEnergy(Monster._energyPerSecond)
         self.say("Zzz...")
+        self._sleepEvent = self._world._scheduler.schedule(1000, self._sleep)
       else:
         self._isSleeping = False
-        self._behaviourTimer.start()
-        self._sleepTimer.stop()
+        self._world._scheduler.requestTurn(self)
+
+        if self._world._eventLog is not None:
+          self._world._eventLog.monsterWoke(self)
+
         self.say("Good morning!")
 
+  # What observe() reports for a cell, by the flags of the cell. Rocks and
+  # ponds hide anything else, and monsters hide fruit and items
+  _cellTypes = [World.Rock if flags & World._rockFlag else
+                World.Pond if flags & World._pondFlag else
+                World.Monster if flags & (World._monsterFlag | World._targetFlag) else
+                World.Fruit if flags & World._fruitFlag else
+                World.Item if flags & World._itemFlag else
+                World.Grass for flags in range(1 << 6)]
+
+  # Whether the class decides for all its monsters due for a turn at once,
+  # instead of behaviour(), with _decideBatch(monsters) returning a decision
+  # and _actOnBatch(monsters, decision) acting on it
+  _decidesInBatches = False
+
+  # Methods a Profiler measures
+  _profiledMethods = ('behaviour', 'sense', 'canMove', 'observe', 'smell', 'move')
+
+  # Attributes making up the state of a monster in the simulation, as
+  # opposed to the ones of monster classes
+  _stateAttributes = ('_speed', '_targetPos', '_moveStart', '_moveLength', '_index', '_turnPending',
+                      '_energy', '_isSleeping', '_leftSleeping', '_fruitEaten', '_moves', '_sleepTime')
+
+  def __copy__(self):
+    # Monsters have both the slots of WorldObject and a __dict__, and monster
+    # classes copy their own memory in onCopy()
+    monster = type(self).__new__(type(self))
+
+    for name in WorldObject.__slots__:
+      setattr(monster, name, getattr(self, name))
+
+    monster.__dict__.update(self.__dict__)
+    monster.onCopy()
+
+    return monster
+
+  def _copyState(self, original, world, objects, events):
+    super(Monster, self)._copyState(original, world, objects, events)
+
+    for name in Monster._stateAttributes:
+      setattr(self, name, getattr(original, name))
+
+    self._sleepEvent = events.get(id(original._sleepEvent))
+    self._items = [objects.get(item, item) for item in original._items]
+
+  def statistics(self):
+    ''' Returns a dictionary describing how the monster has done so far, with
+        its energy, number of fruits eaten, number of moves and time spent
+        sleeping in milliseconds '''
+    return {'energy' : self._energy,
+            'fruitEaten' : self._fruitEaten,
+            'moves' : self._moves,
+            'sleepTime' : self._sleepTime}
+
   #=============================================================================
   # Beginning of monster creators API
   #=============================================================================
@@ -595,57 +1616,63 @@ class Monster(WorldObject):
   def energy(self):
     ''' Returns amount of monsters energy '''
     return self._energy
-        
+
+  def worldRect(self):
+    ''' Returns the Rect of the field of the world monster lives in '''
+    return self._world.rect
+
   def observe(self, direction):
     ''' Returns  the type of object located in specified direction '''
     # Calculate the target cell
     target = self._pos + World.movingVector[direction]
-      
-    if not World.rect.contains(target):
-      # Tried to move off the edge of the world   
+
+    if not self._world.rect.contains(target):
+      # Tried to move off the edge of the world
       return World.Nothing
-    elif target in self._world.rockPositions():
-      return World.Rock
-    elif target in self._world.pondPositions():
-      return World.Pond
-    elif target in self._world.monsterPositions() or target in self._world.monsterTargets():
-      return World.Monster
-    elif target in self._world.fruitPositions():
-      return World.Fruit
-    elif target in self._world.itemPositions():
-      return World.Item
-    else:
-      return World.Grass
+
+    return Monster._cellTypes[self._world._flagsAt(target)]
 
   def canMove(self, direction):
-    ''' Returns fTrue if monster can move in specified direction, 
+    ''' Returns fTrue if monster can move in specified direction,
         False otherwise '''
     # Calculate the target cell
     target = self._pos + World.movingVector[direction]
 
-    if not World.rect.contains(target):
+    if not self._world.rect.contains(target):
       return False
-    elif target in self._world.pondPositions() and self._world.rubberRing in self._items:
+
+    flags = self._world._flagsAt(target)
+
+    if flags & World._pondFlag and self._canSwim():
       return True
-    elif target in self._world.obstaclePositions():
+    elif flags & World._obstacleFlags:
       return False
     else:
       return True
-    
+
   def move(self, direction):
     ''' Move monster in specified direction '''
-    if self._isSleeping:
+    if self._isSleeping or self._targetPos is not None:
+      # Can not move while asleep or in the middle of another move
       return
 
-    if self.canMove(direction): 
+    if self.canMove(direction):
+      self._senses = None
       self._targetPos = self._pos + World.movingVector[direction]
+      self._world._setFlag(self._targetPos, World._targetFlag)
 
-      if self._targetPos in self._world.pondPositions():
+      if self._world._flagsAt(self._targetPos) & World._pondFlag:
         self.say("Whoaa! I am swimming")
-      
-      self._t = 0.0
-      self._moveTimer.setInterval(10 / self._speed)
-      self._moveTimer.start()
+
+      self._moveStart = self._world.time()
+      self._moveLength = Monster._moveDuration / self._speed
+      self._world._scheduler.schedule(self._moveLength, self._finishMove)
+      self._world._notify('objectChanged', self)
+
+      if self._world._eventLog is not None:
+        self._world._eventLog.monsterMoved(self, direction)
+
+      self._moves += 1
 
       # Reduce energy for move
       self._reduceEnergy(Monster._energyPerMove)
@@ -653,15 +1680,107 @@ class Monster(WorldObject):
       # Penalise on energy for moving to occupied cell
       self._reduceEnergy(Monster._energyPenaltyOccupied)
 
-      self._behaviourTimer.start()
+      self._world._scheduler.requestTurn(self)
+
+  def _canSwim(self):
+    return self._world.rubberRing in self._items
+
+  def distanceTo(self, pos):
+    ''' Returns the number of moves needed to get to the specified position,
+        going around rocks and, unless monster has the rubber ring, ponds.
+        Other monsters are not taken into account. Returns None if the
+        position can not be reached '''
+    if not self._world.rect.contains(pos):
+      return None
+
+    field = self._world.pathfinder.distanceField(pos, self._canSwim())
+    distance = field.get(self._pos._y * self._world.width + self._pos._x)
+
+    if distance == -1:
+      return None
+
+    return distance
+
+  def pathTo(self, pos):
+    ''' Returns a list of directions leading to the specified position along
+        a shortest path, an empty list if monster is already there, or None if
+        the position can not be reached. Where several first steps are equally
+        short, one which is not blocked by another monster is preferred '''
+    if self.distanceTo(pos) is None:
+      return None
+
+    field = self._world.pathfinder.distanceField(pos, self._canSwim())
+    width = self._world.width
+
+    path = []
+    current = self._pos
+
+    while current != pos:
+      distance = field.get(current._y * width + current._x, False)
+      steps = []
+
+      for direction in World.movingVector.keys():
+        neighbour = current + World.movingVector[direction]
+
+        # The search got to every cell closer to the target than this one
+        if self._world.rect.contains(neighbour) and field.get(neighbour._y * width + neighbour._x, False) == distance - 1:
+          steps.append(direction)
+
+      if len(path) == 0:
+        # Prefer a first step which can be taken right now
+        steps.sort(key = lambda d: not self.canMove(d))
+
+      path.append(steps[0])
+      current = current + World.movingVector[steps[0]]
+
+    return path
 
   def moveRandomly(self):
     ''' Moves monster to the random movable direction '''
+    passable = self.sense().passable
     allDirections = [World.North, World.South, World.East, World.West]
-    movableDirections = [d for d in allDirections if self.canMove(d)]
-    
+    movableDirections = [d for d in allDirections if passable[d]]
+
     if len(movableDirections) != 0:
-      self.move(random.choice(movableDirections))
+      self.move(self._world._random.choice(movableDirections))
+
+  def sense(self):
+    ''' Returns the Senses of the monster: everything observe(), canMove(),
+        isOnFruit(), isOnItem() and smell() would tell, plus its energy and
+        items, found in a single pass. During a behaviour turn the same
+        object is returned until the monster eats, picks up an item or moves,
+        so calling sense() again is free '''
+    if self._senses is not None and self._world._scheduler._turnOwner is self:
+      return self._senses
+
+    world = self._world
+    cells = world._cells
+    width = world.width
+    x, y = self._pos._x, self._pos._y
+    canSwim = self._canSwim()
+
+    surroundings = []
+    passable = []
+
+    # North, South, East and West, in the order of the directions
+    for neighbourX, neighbourY in ((x, y - 1), (x, y + 1), (x + 1, y), (x - 1, y)):
+      if neighbourX < 0 or neighbourY < 0 or neighbourX >= width or neighbourY >= world.height:
+        surroundings.append(World.Nothing)
+        passable.append(False)
+      else:
+        flags = cells[neighbourY * width + neighbourX]
+        surroundings.append(Monster._cellTypes[flags])
+        passable.append(bool(flags & World._pondFlag and canSwim or not flags & World._obstacleFlags))
+
+    senses = Senses(self._pos, self._energy, tuple(surroundings), tuple(passable),
+                    world.getFruitAtPos(self._pos) is not None, world.getItemAtPos(self._pos) is not None,
+                    tuple((fruit._pos, fruit._type) for fruit in world.fruitsNear(self._pos, Monster._smellDistance)),
+                    tuple(self._items))
+
+    if world._scheduler._turnOwner is self:
+      self._senses = senses
+
+    return senses
 
   def isOnFruit(self):
     ''' Returns True if monster is standing on a fruit, and False otherwise '''
@@ -679,10 +1798,14 @@ class Monster(WorldObject):
     if fruit == None:
       return -1
 
-    # Retain energy for eating fruit
+    if self._world._eventLog is not None:
+      self._world._eventLog.fruitEaten(self, fruit)
+
+    # Retain energy for eating fruit. Also makes sense() see the fruit gone
     self._increaseEnergy(Fruit._energyForFruit[fruit.type()])
+    self._fruitEaten += 1
     fruit.vanish()
-    
+
     # Place a new random fruit somewhere in the world
     self._world.addRandomFruit()
 
@@ -692,8 +1815,8 @@ class Monster(WorldObject):
   def smell(self):
     ''' Return all the fruit positions within a certain Manhattan Distance.
         The returned object is a list of tuples (fruitPosition, fruitType) '''
-    return [(fruit._pos, fruit._type) for fruit in self._world.fruits 
-            if (fruit._pos - self._pos).manhattanLength() <= 15]
+    return [(fruit._pos, fruit._type)
+            for fruit in self._world.fruitsNear(self._pos, Monster._smellDistance)]
 
   def pickItem(self):
     item = self._world.getItemAtPos(self._pos)
@@ -703,9 +1826,13 @@ class Monster(WorldObject):
         self.say("Wow! I can swim now.")
 
       self._items.append(item)
+      self._senses = None
 
       item.vanish()
 
+      if self._world._eventLog is not None:
+        self._world._eventLog.itemPicked(self, item)
+
       if item == self._world.rubberRing:
         item.setOwner(self)
 
@@ -716,27 +1843,54 @@ class Monster(WorldObject):
   def say(self, message, seconds = 1):
     ''' Show speech bubble above the monster with the specified message. Bubble
         dissapears after the specified number of seconds, or lasts forever if seconds is None '''
-    self._speechBubble.setMessage(message)
-    self._speechBubble.show(seconds)
+    if not self._placed:
+      # Not in the world yet, so not seen nor recorded until it is added
+      self._heldSpeech.append((message, seconds))
+      return
+
+    if self._world._speechEnabled:
+      self._world._notify('monsterSaid', self, message, seconds)
+
+    if self._world._eventLog is not None:
+      self._world._eventLog.monsterSaid(self, message, seconds)
 
   def sleep(self, seconds):
     ''' Sleep for the specified number of seconds '''
     self._isSleeping = True
     self._leftSleeping = seconds
 
-    self._sleepTimer.start()
+    if self._world._eventLog is not None:
+      self._world._eventLog.monsterSlept(self, seconds)
+
+    # Wake up every second to count the sleep down
+    self._world._scheduler.cancel(self._sleepEvent)
+    self._sleepEvent = self._world._scheduler.schedule(1000, self._sleep)
+
+  def forkWorld(self, behaviours = False):
+    ''' Returns a copy of the world, and the copy of this monster in it, to try
+        out what would happen, e.g. monster.move(World.East) followed by
+        world.advance(1000). Nothing done in the copy affects the real world.
+        See World.fork() '''
+    world = self._world.fork(behaviours)
+    return world, world.monsters[self._index]
 
-  @Slot()
   def behaviour(self):
-    ''' The main behaviour method. Is called each time monster can perform an 
+    ''' The main behaviour method. Is called each time monster can perform an
         action. To be implemented by monsters creators '''
-    pass 
+    pass
 
   def onCreate(self):
-    ''' Method called when monster is created. To be implemented by monsters 
+    ''' Method called when monster is created. To be implemented by monsters
         creators '''
     pass
 
+  def onCopy(self):
+    ''' Method called on the copy of monster made for a fork or snapshot of
+        the world, whose attributes are still shared with the original. To be
+        implemented by monsters creators whose monsters need their own copy
+        of what they remember '''
+    pass
+
   #=============================================================================
   # End of monster creators API
   #=============================================================================
@@ -747,32 +1901,35 @@ class DefaultMonster(Monster):
     self.say("Hi! I am DefaultMonster")
 
   def behaviour(self):
-    if self.isOnFruit():
+    if self.sense().onFruit:
       self.eatFruit()
 
-    if self.isOnItem():
+    if self.sense().onItem:
       self.pickItem()
 
+    # what the monster senses after eating and picking up
+    senses = self.sense()
+
     # get a list of all fruit positions that are within range
-    nearbyFruit = self.smell()
-      
+    nearbyFruit = senses.smell
+
     if len(nearbyFruit) > 0:
       # if there are fruit in the list, then try to move towards one
-      
+
       # sort the fruit positions into ascending Manhattan distance order
       pointsSortedByDistance = sorted(nearbyFruit, key = lambda d: (d[0]-self._pos).manhattanLength() )
-      
+
       # ... and select the closest one as the target
       nearestFruitPosition = pointsSortedByDistance[0][0]
-      
+
       # try to move towards that fruit, testing for allowed movement
-      if self.pos().x() < nearestFruitPosition.x() and self.canMove(World.East):
+      if self.pos().x() < nearestFruitPosition.x() and senses.canMove(World.East):
         self.move(World.East)
-      elif self.pos().x() > nearestFruitPosition.x() and self.canMove(World.West):
+      elif self.pos().x() > nearestFruitPosition.x() and senses.canMove(World.West):
         self.move(World.West)
-      elif self.pos().y() > nearestFruitPosition.y() and self.canMove(World.North):
+      elif self.pos().y() > nearestFruitPosition.y() and senses.canMove(World.North):
         self.move(World.North)
-      elif self.pos().y() < nearestFruitPosition.y() and self.canMove(World.South):
+      elif self.pos().y() < nearestFruitPosition.y() and senses.canMove(World.South):
         self.move(World.South)
       else:
         # no movement towards the fruit is possible, so try something random instead
@@ -782,3 +1939,14 @@ class DefaultMonster(Monster):
       self.moveRandomly()
 
 
+
+# The Qt views live in the views module, which is only imported when one of
+# them is used, so that importing monsters does not load Qt
+_viewNames = ('SpriteCache', 'TerrainScene', 'WorldView', 'SpeechBubble')
+
+def __getattr__(name):
+  if name in _viewNames:
+    import views
+    return getattr(views, name)
+
+  raise AttributeError("module 'monsters' has no attribute '%s'" % name)
@@ -0,0 +1,191 @@
+''' Measuring how long monsters take to think.
+
+    A Profiler attached to a world counts the calls of every monster to
+    behaviour() and to the API methods sense(), canMove(), observe(), smell()
+    and move(), and records their wall time in histograms. It can also enforce
+    a time budget for each behaviour turn:
+
+      profiler = Profiler(world, budget = 0.005, overBudget = Profiler.Skip)
+      world.run(6000)
+      profiler.dumpJSON('profile.json')
+      profiler.dumpCSV('profile.csv')
+
+    WorldView shows the profile of its world in an overlay, toggled with P.
+'''
+
+import csv, json, logging, math, time
+
+from monsters import Monster
+
+logger = logging.getLogger('monsters')
+
+class Profiler(object):
+  ''' Per-monster call counts, wall time and histograms of behaviour() and
+      the monster API. The methods of the monsters are only wrapped while the
+      profiler is attached, so unprofiled worlds run at full speed '''
+
+  # What to do when a behaviour turn takes longer than the budget: log a
+  # warning, or also make the monster miss its next turn
+  Warn, Skip = range(2)
+
+  # Methods measured, behaviour() first
+  methodNames = Monster._profiledMethods
+
+  # Number of histogram bins. Bin i counts calls taking less than 2 ** i
+  # microseconds, the last one all the slower calls
+  histogramBins = 24
+
+  def __init__(self, world, budget = None, overBudget = Warn):
+    self._world = world
+
+    # Wall time a behaviour turn may take, in seconds, or None
+    self.budget = budget
+    self.overBudget = overBudget
+
+    # Statistics by (monster, method name), each a list [calls, seconds,
+    # slowest call in seconds, histogram]
+    self._stats = {}
+
+    # Monsters which are inside an API call, whose calls to other API
+    # methods are part of that call rather than calls of their own
+    self._inCall = set()
+
+    # Monsters which exceeded the budget and miss their next turn
+    self._skipping = set()
+
+    # Number of turns over the budget by monster
+    self.overruns = {}
+
+    world._profiler = self
+
+    for monster in world.monsters:
+      self.monsterAdded(monster)
+
+  def close(self):
+    ''' Detaches the profiler from its world '''
+    if self._world._profiler is self:
+      self._world._profiler = None
+
+    for monster in self._world.monsters:
+      for name in Profiler.methodNames:
+        monster.__dict__.pop(name, None)
+
+  def monsterAdded(self, monster):
+    ''' Wraps the methods of a monster, called when it is added to the world '''
+    for name in Profiler.methodNames:
+      # The bound method of the monster's class, skipping any earlier wrapper
+      method = getattr(type(monster), name).__get__(monster)
+
+      if name == 'behaviour':
+        wrapper = self._behaviourWrapper(monster, method)
+      else:
+        wrapper = self._callWrapper(monster, name, method)
+
+      setattr(monster, name, wrapper)
+
+  def _behaviourWrapper(self, monster, behaviour):
+    def profiledBehaviour():
+      if monster in self._skipping:
+        self._skipping.discard(monster)
+        monster._missTurn()
+        return
+
+      start = time.perf_counter()
+      behaviour()
+      seconds = time.perf_counter() - start
+
+      self._record(monster, 'behaviour', seconds)
+
+      if self.budget is not None and seconds > self.budget:
+        self.overruns[monster] = self.overruns.get(monster, 0) + 1
+        logger.warning('%s %d took %.1f ms for its turn, the budget is %.1f ms',
+                       type(monster).__name__, monster._index, seconds * 1000, self.budget * 1000)
+
+        if self.overBudget == Profiler.Skip:
+          self._skipping.add(monster)
+
+    return profiledBehaviour
+
+  def _callWrapper(self, monster, name, method):
+    def profiledCall(*args):
+      if monster in self._inCall:
+        return method(*args)
+
+      self._inCall.add(monster)
+      start = time.perf_counter()
+
+      try:
+        return method(*args)
+      finally:
+        self._record(monster, name, time.perf_counter() - start)
+        self._inCall.discard(monster)
+
+    return profiledCall
+
+  def _record(self, monster, name, seconds):
+    stats = self._stats.get((monster, name))
+
+    if stats is None:
+      stats = self._stats[(monster, name)] = [0, 0.0, 0.0, [0] * Profiler.histogramBins]
+
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] = max(stats[2], seconds)
+
+    microseconds = seconds * 1e6
+    histogramBin = 0 if microseconds < 1 else int(math.log(microseconds, 2)) + 1
+    stats[3][min(histogramBin, Profiler.histogramBins - 1)] += 1
+
+  def report(self):
+    ''' Returns a list of rows, one for each monster and method called, with
+        the monster index and class, the method, the number of calls, the
+        total and slowest time in seconds, the number of behaviour turns over
+        the budget and the histogram of the times '''
+    rows = []
+
+    for (monster, name), (calls, seconds, slowest, histogram) in self._stats.items():
+      overruns = self.overruns.get(monster, 0) if name == 'behaviour' else 0
+
+      rows.append({'monster' : monster._index, 'class' : type(monster).__name__, 'method' : name,
+                   'calls' : calls, 'seconds' : seconds, 'slowest' : slowest, 'overruns' : overruns,
+                   'histogram' : list(histogram)})
+
+    return sorted(rows, key = lambda row: (row['monster'], Profiler.methodNames.index(row['method'])))
+
+  def dumpJSON(self, filename):
+    ''' Writes the report into a JSON file '''
+    outputFile = open(filename, 'w')
+    try:
+      json.dump({'histogramBins' : ['< %d us' % (2 ** i) for i in range(Profiler.histogramBins - 1)]
+                                   + ['slower'],
+                 'rows' : self.report()}, outputFile, indent = 1)
+    finally:
+      outputFile.close()
+
+  def dumpCSV(self, filename):
+    ''' Writes the report into a CSV file, one column for each histogram bin '''
+    outputFile = open(filename, 'w', newline = '')
+    try:
+      writer = csv.writer(outputFile)
+      writer.writerow(['monster', 'class', 'method', 'calls', 'seconds', 'slowest', 'overruns']
+                      + ['< %d us' % (2 ** i) for i in range(Profiler.histogramBins - 1)] + ['slower'])
+
+      for row in self.report():
+        writer.writerow([row['monster'], row['class'], row['method'], row['calls'],
+                         row['seconds'], row['slowest'], row['overruns']] + row['histogram'])
+    finally:
+      outputFile.close()
+
+  def summary(self):
+    ''' Returns a few lines of text with the behaviour time of each monster,
+        slowest first, as shown in the overlay of WorldView '''
+    rows = [row for row in self.report() if row['method'] == 'behaviour']
+    rows.sort(key = lambda row: -row['seconds'])
+
+    lines = ['%-16s %8s %10s %10s' % ('monster', 'turns', 'mean ms', 'max ms')]
+
+    for row in rows:
+      lines.append('%-16s %8d %10.3f %10.3f' % ('%s %d' % (row['class'], row['monster']), row['calls'],
+                                               row['seconds'] * 1000 / row['calls'], row['slowest'] * 1000))
+
+    return '\n'.join(lines)
@@ -0,0 +1,373 @@
+''' Deciding for many monsters of a class at once with NumPy.
+
+    A SwarmMonster has no behaviour() of its own. Its class has a policy()
+    which gets a Swarm, holding what all its monsters due for a turn at the
+    same time sense as arrays with a row per monster, and fills in what each
+    of them does:
+
+      class Runner(SwarmMonster):
+        @classmethod
+        def policy(cls, swarm):
+          swarm.eat[:] = swarm.onFruit
+          swarm.moves[swarm.passable[:, World.East]] = World.East
+
+    Moves into the same cell, or into cells which are not passable, are
+    turned into staying put all at once, keeping the move of the first monster
+    in the turn order. The monsters of a swarm act together on the turn of
+    the first of them, and the moves which can start as planned start, and
+    finish, all at once. A monster which does not move waits for the time of a
+    move before its next turn.
+
+    This module needs NumPy. The rest of the framework does not.
+'''
+
+import numpy
+
+from monsters import Point, World, Monster
+
+# Cell offsets of the directions, indexed by direction
+_vectors = numpy.array([(World.movingVector[direction].x(), World.movingVector[direction].y())
+                        for direction in range(4)])
+
+# What Monster.observe() reports for a cell, by the flags of the cell
+_cellTypes = numpy.array(Monster._cellTypes, dtype = numpy.int8)
+
+# Offsets of the cells at each distance from a cell, by distance
+_ringCache = {}
+
+def _ring(distance):
+  ''' Returns the offsets of the cells the specified number of moves away, as
+      an array of rows (dx, dy) '''
+  if not distance in _ringCache:
+    _ringCache[distance] = numpy.array([(dx, dy) for dx in range(-distance, distance + 1)
+                                        for dy in sorted(set([distance - abs(dx), abs(dx) - distance]))])
+
+  return _ringCache[distance]
+
+def _setFlags(world, indices, flag):
+  ''' Sets a flag of the occupancy grid in the cells with the distinct
+      indices of an array, like World._setFlag() does for one cell '''
+  cells = world._cells
+
+  if isinstance(cells, bytearray) and world._freeCells is None:
+    view = numpy.frombuffer(cells, dtype = numpy.uint8)
+    world._freeCount -= int(numpy.count_nonzero(view[indices] == 0))
+    view[indices] |= flag
+  else:
+    # Chunked cells and the list of free cells are kept up to date one by one
+    for index in indices.tolist():
+      world._setFlag(world._cellPos(index), flag)
+
+def _clearFlags(world, indices, flag):
+  ''' Clears a flag of the occupancy grid in the cells with the distinct
+      indices of an array, like World._clearFlag() does for one cell '''
+  cells = world._cells
+
+  if isinstance(cells, bytearray) and world._freeCells is None:
+    view = numpy.frombuffer(cells, dtype = numpy.uint8)
+    occupied = view[indices] != 0
+    view[indices] &= ~flag & 0xFF
+    world._freeCount += int(numpy.count_nonzero(occupied & (view[indices] == 0)))
+  else:
+    for index in indices.tolist():
+      world._clearFlag(world._cellPos(index), flag)
+
+def _finishMoves(world, monsters, targets):
+  ''' Puts monsters into their target cells once their moves started by
+      Swarm._startMoves() are over, like Monster._finishMove() does for one '''
+  scheduler = world._scheduler
+
+  _clearFlags(world, numpy.array([monster._pos._y * world.width + monster._pos._x for monster in monsters]),
+              World._monsterFlag)
+  _clearFlags(world, targets, World._targetFlag)
+  _setFlags(world, targets, World._monsterFlag)
+
+  for monster in monsters:
+    monster._pos = monster._targetPos
+    monster._targetPos = None
+
+    if scheduler.behaviours and not monster._turnPending:
+      monster._turnPending = True
+      scheduler._turns.append(monster)
+
+  if len(world._observers) != 0:
+    for monster in monsters:
+      world._notify('objectChanged', monster)
+
+class Swarm(object):
+  ''' What the monsters of a swarm due for a turn sense, and what they are to
+      do. Row i of each array belongs to monsters[i], and directions index the
+      columns of surroundings and passable '''
+
+  def __init__(self, world, monsters):
+    self.world = world
+    self.monsters = monsters
+
+    count = len(monsters)
+    width, height = world.width, world.height
+
+    # Positions as (x, y), energy, and whether each monster can swim
+    self.positions = numpy.array([(monster._pos._x, monster._pos._y) for monster in monsters],
+                                 dtype = numpy.int64).reshape(count, 2)
+    self.energy = numpy.array([monster._energy for monster in monsters], dtype = numpy.int64)
+    self.canSwim = numpy.array([world.rubberRing in monster._items for monster in monsters], dtype = bool)
+
+    # Occupancy flags of the four neighbours of each monster
+    neighbours = self.positions[:, numpy.newaxis, :] + _vectors[numpy.newaxis, :, :]
+    inside = ((neighbours[:, :, 0] >= 0) & (neighbours[:, :, 0] < width) &
+              (neighbours[:, :, 1] >= 0) & (neighbours[:, :, 1] < height))
+    indices = numpy.where(inside, neighbours[:, :, 1] * width + neighbours[:, :, 0], 0)
+    flags = self._cellFlags(indices)
+
+    # What observe() and canMove() tell in each direction
+    self.surroundings = numpy.where(inside, _cellTypes[flags], World.Nothing)
+    self.passable = inside & ((((flags & World._pondFlag) != 0) & self.canSwim[:, numpy.newaxis]) |
+                              ((flags & World._obstacleFlags) == 0))
+
+    # Fruits which can be eaten, as rows (x, y, type)
+    self.fruits = numpy.array([(fruit._pos._x, fruit._pos._y, fruit._type) for fruit in world.fruits
+                               if not fruit._isVanished], dtype = numpy.int64).reshape(-1, 3)
+
+    here = self.positions[:, 1] * width + self.positions[:, 0]
+    self.onFruit = numpy.isin(here, self.fruits[:, 1] * width + self.fruits[:, 0])
+
+    ring = world.rubberRing
+    self.onItem = numpy.zeros(count, dtype = bool)
+    if ring is not None and not ring._isVanished:
+      self.onItem = here == ring._pos._y * width + ring._pos._x
+
+    # What to do, filled in by the policy: eat the fruit or pick up the item
+    # the monster stands on, and the direction to move in or Stay
+    self.eat = numpy.zeros(count, dtype = bool)
+    self.pick = numpy.zeros(count, dtype = bool)
+    self.moves = numpy.full(count, SwarmMonster.Stay, dtype = numpy.int64)
+
+    # Random numbers for the policy, drawn from the world's generator so that
+    # a world plays out the same way every time with the same seed
+    self.random = numpy.random.default_rng(world._random.getrandbits(64))
+
+  def _cellFlags(self, indices):
+    cells = self.world._cells
+
+    if isinstance(cells, bytearray):
+      return numpy.frombuffer(cells, dtype = numpy.uint8)[indices]
+
+    # Chunked cells are read one by one
+    return numpy.array([cells[index] for index in indices.ravel()], dtype = numpy.uint8).reshape(indices.shape)
+
+  def nearestFruits(self, maxDistance = Monster._smellDistance):
+    ''' Returns, for each monster, the row in fruits of the nearest fruit
+        within maxDistance moves in Manhattan distance, not counting one it
+        stands on, or -1. The fruits are put into a grid covering the
+        monsters and maxDistance cells around them, in which the cells at
+        each distance around all the monsters are then looked up at once,
+        until every monster found a fruit '''
+    nearest = numpy.full(len(self.monsters), -1, dtype = numpy.int64)
+
+    if len(self.fruits) == 0 or len(self.monsters) == 0:
+      return nearest
+
+    # Corner and width of the grid, which leaves out the cells too far away
+    left, top = self.positions.min(axis = 0) - maxDistance
+    right, bottom = self.positions.max(axis = 0) + maxDistance
+    width = right - left + 1
+
+    # Rows of the fruits by cell of the grid, or -1
+    grid = numpy.full(width * (bottom - top + 1), -1, dtype = numpy.int32)
+    x, y = self.fruits[:, 0] - left, self.fruits[:, 1] - top
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y <= bottom - top)
+    grid[y[inside] * width + x[inside]] = numpy.flatnonzero(inside)
+
+    cells = (self.positions[:, 1] - top) * width + (self.positions[:, 0] - left)
+    pending = numpy.arange(len(self.monsters))
+
+    for distance in range(1, maxDistance + 1):
+      ring = _ring(distance)
+      candidates = grid[cells[pending, numpy.newaxis] + (ring[:, 1] * width + ring[:, 0])]
+
+      # The first fruit found in the order of the ring
+      found = candidates >= 0
+      first = found.argmax(axis = 1)
+      anyFound = found[numpy.arange(len(pending)), first]
+
+      nearest[pending[anyFound]] = candidates[anyFound, first[anyFound]]
+      pending = pending[~anyFound]
+
+      if len(pending) == 0:
+        break
+
+    return nearest
+
+  def _resolveMoves(self):
+    ''' Turns moves which are not passable, and all but the first of the
+        moves into the same cell, into Stay '''
+    moving = self.moves != SwarmMonster.Stay
+    direction = numpy.where(moving, self.moves, 0)
+    moving &= self.passable[numpy.arange(len(self.monsters)), direction]
+
+    targets = self.positions + _vectors[direction]
+    targets = targets[:, 1] * self.world.width + targets[:, 0]
+
+    # numpy.unique() returns the first index of each target
+    movers = numpy.flatnonzero(moving)
+    firsts = movers[numpy.unique(targets[movers], return_index = True)[1]]
+
+    self.moves = numpy.full(len(self.monsters), SwarmMonster.Stay, dtype = numpy.int64)
+    self.moves[firsts] = direction[firsts]
+
+  def _act(self):
+    ''' Takes the actions decided on. Moves which can start as planned, into
+        cells which are still free and not ponds, of monsters with energy to
+        spare, start all at once. The others go through Monster.move() one by
+        one, which also tells off monsters whose cell was taken meanwhile '''
+    world = self.world
+    monsters = self.monsters
+
+    for i in numpy.flatnonzero(self.eat | self.pick).tolist():
+      monster = monsters[i]
+
+      if self.eat[i] and world.getFruitAtPos(monster._pos) is not None:
+        monster.eatFruit()
+
+      if self.pick[i]:
+        monster.pickItem()
+
+    movers = numpy.flatnonzero(self.moves != SwarmMonster.Stay)
+    directions = self.moves[movers]
+    targets = self.positions[movers] + _vectors[directions]
+    targets = targets[:, 1] * world.width + targets[:, 0]
+
+    # Eating may have changed the energy and speed of the monsters
+    ready = numpy.array([monster._speed == 1.0 and not monster._isSleeping and monster._targetPos is None and
+                         monster._energy - Monster._energyPerMove >= Monster._energyCriticalLevel
+                         for monster in [monsters[i] for i in movers.tolist()]], dtype = bool)
+    ready &= (self._cellFlags(targets) & World._obstacleFlags) == 0
+
+    if ready.any():
+      self._startMoves([monsters[i] for i in movers[ready].tolist()], targets[ready], directions[ready])
+
+    for i, direction in zip(movers[~ready].tolist(), directions[~ready].tolist()):
+      Monster.move(monsters[i], direction)
+
+    for monster in monsters:
+      if monster._targetPos is None and not monster._isSleeping and not monster._turnPending:
+        monster._missTurn()
+
+  def _startMoves(self, monsters, targets, directions):
+    ''' Starts the moves of monsters into the cells with the given indices,
+        which are free, all at once. The first of the monsters finishes them
+        all when the time of a move is over '''
+    world = self.world
+    width = world.width
+    start = world.time()
+
+    # All of the monsters go at normal speed
+    length = float(Monster._moveDuration)
+
+    _setFlags(world, targets, World._targetFlag)
+
+    for monster, index in zip(monsters, targets.tolist()):
+      monster._senses = None
+      monster._targetPos = Point(index % width, index // width)
+      monster._moveStart = start
+      monster._moveLength = length
+      monster._moves += 1
+      monster._energy -= Monster._energyPerMove
+
+    if len(world._observers) != 0:
+      for monster in monsters:
+        world._notify('objectChanged', monster)
+
+    if world._eventLog is not None:
+      for monster, direction in zip(monsters, directions.tolist()):
+        world._eventLog.monsterMoved(monster, direction)
+        world._eventLog.energyChanged(monster)
+
+    monsters[0]._moveGroup = (monsters, targets)
+    world._scheduler.schedule(length, monsters[0]._finishMoves)
+
+class SwarmMonster(Monster):
+  ''' A monster whose class decides for all its monsters due for a turn at
+      once, with policy() '''
+
+  # Value of Swarm.moves for a monster which does not move
+  Stay = -1
+
+  _decidesInBatches = True
+
+  def __init__(self, world, monsterType, position = None):
+    # Monsters of the swarm whose moves this monster finishes, and the cell
+    # indices they move into, or None. See Swarm._startMoves()
+    self._moveGroup = None
+
+    super(SwarmMonster, self).__init__(world, monsterType, position)
+
+  def _copyState(self, original, world, objects, events):
+    super(SwarmMonster, self)._copyState(original, world, objects, events)
+
+    self._moveGroup = None
+
+    if original._moveGroup is not None:
+      monsters, targets = original._moveGroup
+      self._moveGroup = ([objects[monster] for monster in monsters], targets)
+
+  @classmethod
+  def policy(cls, swarm):
+    ''' Decides what the monsters of the swarm do, by filling in swarm.eat,
+        swarm.pick and swarm.moves. To be implemented by monsters creators '''
+    pass
+
+  @classmethod
+  def _decideBatch(cls, monsters):
+    swarm = Swarm(monsters[0]._world, monsters)
+    cls.policy(swarm)
+    swarm._resolveMoves()
+
+    return swarm
+
+  @classmethod
+  def _actOnBatch(cls, monsters, swarm):
+    swarm._act()
+
+  def _finishMoves(self):
+    monsters, targets = self._moveGroup
+    self._moveGroup = None
+
+    _finishMoves(self._world, monsters, targets)
+
+  def behaviour(self):
+    # A turn of its own, e.g. when the world is run by a WorkerPool
+    type(self)._decideBatch([self])._act()
+
+class GreedySwarm(SwarmMonster):
+  ''' Example of a swarm: like DefaultMonster, eats and picks up what it
+      finds, heads for the nearest fruit it can smell, trying East, West,
+      North and South in that order, and otherwise moves randomly '''
+
+  @classmethod
+  def policy(cls, swarm):
+    swarm.eat[:] = swarm.onFruit
+    swarm.pick[:] = swarm.onItem
+
+    nearest = swarm.nearestFruits()
+    smelling = nearest != -1
+
+    offset = numpy.zeros(swarm.positions.shape, dtype = numpy.int64)
+    offset[smelling] = swarm.fruits[nearest[smelling], :2] - swarm.positions[smelling]
+
+    wanted = numpy.zeros(swarm.passable.shape, dtype = bool)
+    wanted[:, World.East] = offset[:, 0] > 0
+    wanted[:, World.West] = offset[:, 0] < 0
+    wanted[:, World.North] = offset[:, 1] < 0
+    wanted[:, World.South] = offset[:, 1] > 0
+    wanted &= swarm.passable & smelling[:, numpy.newaxis]
+
+    # The first direction wanted in order of preference, assigned last
+    for direction in (World.South, World.North, World.West, World.East):
+      swarm.moves[wanted[:, direction]] = direction
+
+    # A random passable direction for the others
+    undecided = swarm.moves == SwarmMonster.Stay
+    weights = swarm.random.random(swarm.passable.shape) * swarm.passable
+    randomMoves = numpy.where(weights.max(axis = 1) > 0, weights.argmax(axis = 1), SwarmMonster.Stay)
+    swarm.moves[undecided] = randomMoves[undecided]
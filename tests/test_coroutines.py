@@ -0,0 +1,35 @@
+''' Tests of monsters written as coroutines '''
+
+import os, unittest
+
+from monsters import World
+from coroutines import CoroutineMonster
+
+worldFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worlds', '1.world')
+
+class WaitingMonster(CoroutineMonster):
+  ''' Waits a second at a time, noting the time it wakes up at '''
+
+  def onCreate(self):
+    self.wakeUps = []
+
+  async def run(self):
+    while True:
+      await self.wait(1000)
+      self.wakeUps.append(self._world._scheduler._time)
+
+class CoroutineTest(unittest.TestCase):
+
+  def testWait(self):
+    world = World(worldFile, 1)
+    monster = WaitingMonster(world, 1)
+    world.addMonster(monster)
+    world.run(1000)
+
+    self.assertTrue(len(monster.wakeUps) > 2)
+
+    for before, after in zip(monster.wakeUps, monster.wakeUps[1:]):
+      self.assertEqual(after - before, 1000)
+
+if __name__ == '__main__':
+  unittest.main()
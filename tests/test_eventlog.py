@@ -0,0 +1,60 @@
+''' Tests of recording runs into event logs and replaying them '''
+
+import os, shutil, tempfile, unittest
+
+from monsters import World, DefaultMonster
+from bender import Bender
+import eventlog
+
+worldFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worlds', '1.world')
+
+class ReplayTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'run.mlog')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testMonstersAddedAfterAttaching(self):
+    world = World(worldFile, 1)
+    log = eventlog.EventLog(world, self.filename)
+
+    for i in range(4):
+      world.addMonster((Bender if i % 2 else DefaultMonster)(world, i + 1))
+
+    # Positions and energy of the monsters not in the middle of a move
+    states = {}
+
+    for step in range(30):
+      world.run(50)
+      states[world.time()] = dict((monster._index, ((monster._pos._x, monster._pos._y), monster._energy))
+                                  for monster in world.monsters if monster._targetPos is None)
+
+    log.close()
+    replay = eventlog.Replay(self.filename)
+
+    for time, expected in sorted(states.items()):
+      monsters = replay.stateAt(time).monsters
+      self.assertEqual(dict((index, (monsters[index][eventlog.ReplayState.Pos],
+                                     monsters[index][eventlog.ReplayState.Energy])) for index in expected),
+                       expected)
+
+    # Each monster's greeting from onCreate() is its own
+    state = replay.stateAt(0)
+    for index in range(4):
+      message = state.monsters[index][eventlog.ReplayState.Message][0]
+      self.assertEqual(message, 'Hi! I am %s' % ('Bender' if index % 2 else 'DefaultMonster'))
+
+  def testMonsterAddedWithItsEnergy(self):
+    world = World(worldFile, 1)
+    log = eventlog.EventLog(world, self.filename)
+    world.addMonster(DefaultMonster(world, 1))
+    log.close()
+
+    monster = eventlog.Replay(self.filename).stateAt(0).monsters[0]
+    self.assertEqual(monster[eventlog.ReplayState.Energy], world.monsters[0]._energy)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+''' Tests of forks and snapshots of a world '''
+
+import os, unittest
+
+from monsters import World, DefaultMonster
+
+worldFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worlds', '1.world')
+
+class CountingMonster(DefaultMonster):
+  ''' Counts its turns; the first monster to get a turn forks the world '''
+
+  forks = []
+
+  def onCreate(self):
+    self.turns = 0
+
+  def behaviour(self):
+    self.turns += 1
+
+    if len(CountingMonster.forks) == 0:
+      CountingMonster.forks.append(self.forkWorld(True)[0])
+
+    DefaultMonster.behaviour(self)
+
+class ForkTest(unittest.TestCase):
+
+  def setUp(self):
+    self.world = World(worldFile, 1)
+
+  def testForkInsideBehaviour(self):
+    CountingMonster.forks = []
+
+    for i in range(4):
+      self.world.addMonster(CountingMonster(self.world, i + 1))
+
+    self.world.run(1)
+    forked = CountingMonster.forks[0]
+
+    # The monsters after the one which forked still get their turn in the fork
+    forked.advance(0)
+
+    for monster in forked.monsters:
+      self.assertEqual(monster.turns, 1)
+
+  def testRestoreRemovedMonster(self):
+    self.world.addMonster(DefaultMonster(self.world, 1))
+    first = self.world.snapshot()
+
+    self.world.addMonster(DefaultMonster(self.world, 2))
+    self.world.run(10)
+    second = self.world.snapshot()
+
+    self.world.restore(first)
+    self.assertEqual(len(self.world.monsters), 1)
+
+    self.world.restore(second)
+    self.assertEqual(len(self.world.monsters), 2)
+
+    for monster, copied in zip(self.world.monsters, second.monsters):
+      self.assertEqual(monster.pos(), copied.pos())
+      self.assertIs(monster._world, self.world)
+
+    self.world.advance(1000)
+
+  def testSnapshotKeepsItsTerrainAndFreeCells(self):
+    self.world._listFreeCells()
+    snapshot = self.world.snapshot()
+    masks = bytes(snapshot._neighbourMasks)
+    freeCells = list(snapshot._freeCells)
+
+    # Changes of the world after the snapshot leave the snapshot as it was
+    self.world.addMonster(DefaultMonster(self.world, 1))
+    pos = self.world.randomEmptyPos()
+    self.world._setFlag(pos, World._rockFlag)
+    self.world._clearFlag(pos, World._rockFlag)
+    self.world._setFlag(pos, World._pondFlag)
+
+    self.assertEqual(bytes(snapshot._neighbourMasks), masks)
+    self.assertEqual(snapshot._freeCells, freeCells)
+    self.assertNotEqual(bytes(self.world._neighbourMasks), masks)
+    self.assertEqual(len(self.world._freeCells), len(freeCells) - 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+''' Tests of the notifications a world sends to its observers '''
+
+import os, unittest
+
+from monsters import World, Monster, DefaultMonster, PickableWorldObject
+
+worldFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worlds', '1.world')
+
+class RecordingObserver(object):
+  ''' Records the events of a world, reading the fields a view would read '''
+
+  def __init__(self):
+    self.events = []
+
+  def _read(self, obj):
+    obj._pos.x(), obj._pos.y(), obj._image, obj._z
+
+    if isinstance(obj, Monster):
+      obj._targetPos, obj._moveStart, obj._moveLength, obj._energy
+    elif isinstance(obj, PickableWorldObject):
+      obj._animation, obj._animationStart, obj._isVanished
+
+  def objectAdded(self, obj):
+    self._read(obj)
+    self.events.append(('objectAdded', obj))
+
+  def objectRemoved(self, obj):
+    self.events.append(('objectRemoved', obj))
+
+  def objectChanged(self, obj):
+    self._read(obj)
+    self.events.append(('objectChanged', obj))
+
+  def terrainChanged(self, pos):
+    self.events.append(('terrainChanged', pos))
+
+  def monsterSaid(self, monster, message, seconds):
+    self.events.append(('monsterSaid', monster))
+
+class ObserverTest(unittest.TestCase):
+
+  def setUp(self):
+    self.world = World(worldFile, 1)
+    self.observer = RecordingObserver()
+    self.world.addObserver(self.observer)
+
+  def events(self, name):
+    return [obj for event, obj in self.observer.events if event == name]
+
+  def testObjectsAreAddedOnceComplete(self):
+    fruit = self.world.addRandomFruit()
+    monster = DefaultMonster(self.world, 1)
+    self.world.addMonster(monster)
+
+    self.assertEqual(self.events('objectAdded'), [fruit, monster])
+
+  def testObjectsChangeOnlyOnceAdded(self):
+    added = set(self.world.objects())
+
+    for i in range(4):
+      self.world.addMonster(DefaultMonster(self.world, i + 1))
+
+    self.world.run(3000)
+
+    for event, obj in self.observer.events:
+      if event == 'objectAdded':
+        added.add(obj)
+      elif event != 'terrainChanged':
+        self.assertIn(obj, added, event)
+
+  def testEatingFruit(self):
+    monster = DefaultMonster(self.world, 1)
+    self.world.addMonster(monster)
+    self.world.run(3000)
+
+    fruitEaten = monster.statistics()['fruitEaten']
+
+    # Each fruit eaten is replaced by a new one
+    self.assertTrue(fruitEaten > 0)
+    self.assertEqual(len(self.events('objectAdded')), 1 + fruitEaten)
+    self.assertEqual(len(self.events('objectRemoved')), fruitEaten)
+
+if __name__ == '__main__':
+  unittest.main()
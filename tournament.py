@@ -0,0 +1,120 @@
+''' Runs matches between monster classes without any windows, spread over all
+    the processor cores, and prints a table of how each class did.
+
+    Example:
+
+      python tournament.py monsters:DefaultMonster bender:Bender main:MyMonster \\
+        --worlds worlds/1.world worlds/water.world --seeds 1 2 3 --ticks 6000
+'''
+
+import argparse, importlib, multiprocessing, random
+
+from monsters import World
+
+# Counters taken from Monster.statistics() for the results table
+statisticNames = ['energy', 'fruitEaten', 'moves', 'sleepTime']
+
+def monsterClassName(monsterClass):
+  ''' Returns the 'module:Class' name of a monster class '''
+  if isinstance(monsterClass, str):
+    return monsterClass
+
+  return '%s:%s' % (monsterClass.__module__, monsterClass.__name__)
+
+def loadMonsterClass(name):
+  ''' Imports a monster class given as 'module:Class' '''
+  moduleName, className = name.split(':')
+  return getattr(importlib.import_module(moduleName), className)
+
+def playMatch(match):
+  ''' Plays a single match, given as a tuple (monster class names, world file,
+      seed, ticks, copies of each monster). Returns a list of result rows, one
+      for each monster '''
+  names, worldFile, seed, ticks, copies = match
+
+  # Monsters may use the random module directly, so seed it as well
+  random.seed(seed)
+
+  world = World(worldFile, seed)
+  world.setSpeechEnabled(False)
+
+  monsters = []
+  for copy in range(copies):
+    for name in names:
+      monster = loadMonsterClass(name)(world, len(monsters) % 10 + 1)
+      world.addMonster(monster)
+      monsters.append((name, monster))
+
+  world.run(ticks)
+
+  results = []
+  for name, monster in monsters:
+    row = {'monster' : name, 'world' : worldFile, 'seed' : seed}
+    row.update(monster.statistics())
+    results.append(row)
+
+  return results
+
+def runTournament(monsterClasses, worldFiles, seeds, ticks, copies = 1, processes = None):
+  ''' Plays a match on every world with every seed between the given monster
+      classes (classes or 'module:Class' names). Matches are run by a pool of
+      processes, one per core unless processes is given. Returns a list of
+      result rows, one for each monster in each match '''
+  names = [monsterClassName(monsterClass) for monsterClass in monsterClasses]
+  matches = [(names, worldFile, seed, ticks, copies) for worldFile in worldFiles for seed in seeds]
+
+  if processes == 1:
+    matchResults = [playMatch(match) for match in matches]
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      matchResults = pool.map(playMatch, matches)
+    finally:
+      pool.close()
+      pool.join()
+
+  return [row for results in matchResults for row in results]
+
+def summarise(results):
+  ''' Returns a list of rows with the statistics of each monster class
+      averaged over all the matches, best energy first '''
+  summary = {}
+
+  for row in results:
+    totals = summary.setdefault(row['monster'], dict((name, 0) for name in statisticNames + ['count']))
+    totals['count'] += 1
+    for name in statisticNames:
+      totals[name] += row[name]
+
+  rows = []
+  for monster, totals in summary.items():
+    row = {'monster' : monster, 'count' : totals['count']}
+    for name in statisticNames:
+      row[name] = float(totals[name]) / totals['count']
+    rows.append(row)
+
+  return sorted(rows, key = lambda row: -row['energy'])
+
+def formatTable(rows):
+  ''' Returns the summary rows formatted as a text table '''
+  lines = ['%-30s %6s' % ('monster', 'games') + ''.join(' %10s' % name for name in statisticNames)]
+
+  for row in rows:
+    lines.append('%-30s %6d' % (row['monster'], row['count'])
+                 + ''.join(' %10.1f' % row[name] for name in statisticNames))
+
+  return '\n'.join(lines)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Run matches between monster classes.')
+  parser.add_argument('monsters', nargs = '+', help = 'monster classes as module:Class')
+  parser.add_argument('--worlds', nargs = '+', default = ['worlds/1.world', 'worlds/water.world'])
+  parser.add_argument('--seeds', nargs = '+', type = int, default = [1, 2, 3])
+  parser.add_argument('--ticks', type = int, default = 6000, help = 'length of each match in ticks')
+  parser.add_argument('--copies', type = int, default = 1, help = 'monsters of each class in a match')
+  parser.add_argument('--processes', type = int, default = None, help = 'defaults to the number of cores')
+  args = parser.parse_args()
+
+  results = runTournament(args.monsters, args.worlds, args.seeds, args.ticks, args.copies, args.processes)
+
+  print(formatTable(summarise(results)))
@@ -0,0 +1,514 @@
+''' Qt windows showing worlds. Only imported when a window is opened, e.g. by
+    World.simulate(), so that the simulation itself runs without Qt '''
+
+import sys, os, time
+
+from collections import OrderedDict
+
+from PySide6.QtCore import *
+from PySide6.QtGui import *
+from PySide6.QtWidgets import *
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+
+from monsters import World, PickableWorldObject, Monster
+
+class SpriteCache(object):
+  ''' Pixmaps of the images used by the views, decoded and scaled once per
+      process and shared by all the graphics items showing them '''
+
+  # Directory the images are loaded from
+  directory = './images'
+
+  # Pixmaps by (image path, size in pixels), size None meaning not scaled
+  _pixmaps = {}
+
+  @classmethod
+  def pixmap(cls, image, size = None):
+    ''' Returns the pixmap of an image file scaled to size x size pixels '''
+    key = (image, size)
+
+    if not key in cls._pixmaps:
+      pixmap = QPixmap(image)
+
+      if size != None:
+        pixmap = pixmap.scaled(size, size, mode = Qt.SmoothTransformation)
+
+      cls._pixmaps[key] = pixmap
+
+    return cls._pixmaps[key]
+
+  @classmethod
+  def preload(cls, size):
+    ''' Loads every image in the images directory scaled to the given size '''
+    for name in sorted(os.listdir(cls.directory)):
+      if name.endswith('.png'):
+        cls.pixmap(cls.directory + '/' + name, size)
+
+class TerrainScene(QGraphicsScene):
+  ''' Graphics scene which paints the grass, rocks and ponds of a world as its
+      background, straight from the occupancy grid of the world. Views cache
+      the background, so the static terrain is painted once instead of on
+      every frame '''
+
+  def __init__(self, world, cellSize):
+    super(TerrainScene, self).__init__()
+
+    self._world = world
+    self._cellSize = cellSize
+    self._grass = SpriteCache.pixmap('./images/grass.png')
+    self._pond = SpriteCache.pixmap('./images/pond.png', cellSize)
+    self._rocks = [None] + [SpriteCache.pixmap('./images/boulder%d.png' % rockType, cellSize)
+                            for rockType in range(1, 5)]
+
+  def terrainChanged(self, pos):
+    ''' Repaints the background of the cell at pos '''
+    self.invalidate(QRectF(pos.x() * self._cellSize, pos.y() * self._cellSize,
+                           self._cellSize, self._cellSize), QGraphicsScene.BackgroundLayer)
+
+  def drawBackground(self, painter, rect):
+    grassWidth, grassHeight = self._grass.width(), self._grass.height()
+    painter.drawTiledPixmap(rect, self._grass, QPointF(rect.left() % grassWidth, rect.top() % grassHeight))
+
+    world = self._world
+    left, top = max(int(rect.left() // self._cellSize), 0), max(int(rect.top() // self._cellSize), 0)
+    right = min(int(rect.right() // self._cellSize), world.rect.width() - 1)
+    bottom = min(int(rect.bottom() // self._cellSize), world.rect.height() - 1)
+
+    for y in range(top, bottom + 1):
+      for x in range(left, right + 1):
+        index = y * world.width + x
+
+        if world._cells[index] & World._rockFlag:
+          painter.drawPixmap(x * self._cellSize, y * self._cellSize, self._rocks[world._rockTypes[index]])
+        elif world._cells[index] & World._pondFlag:
+          painter.drawPixmap(x * self._cellSize, y * self._cellSize, self._pond)
+
+class WorldView(object):
+  ''' Window showing a world. Attaches to the world as an observer, so the
+      simulation itself does not need Qt, and drives the world clock from a
+      QTimer '''
+
+  # Size of each individual cell, in pixels
+  cellSize = 100
+
+  # Time scales to choose from with the + and - keys. None runs the world as
+  # fast as possible
+  timeScales = [1, 2, 4, 8, 16, 32, 64, None]
+
+  # Real time in milliseconds each frame may spend advancing the world when
+  # it runs as fast as possible
+  unlimitedFrameBudget = 20
+
+  # Number of frames of wobble in each direction while a monster moves
+  _wobbleFrames = 5
+
+  def __init__(self, world, openGL = False):
+    self._world = world
+
+    # Qt allows only one application per process, so share it between views
+    self._app = QApplication.instance() or QApplication(sys.argv)
+
+    SpriteCache.preload(self.cellSize)
+
+    # Create a graphics scene to display objects
+    self.scene = TerrainScene(world, self.cellSize)
+    self.scene.setSceneRect(0, 0, self.cellSize * world.rect.width(), self.cellSize * world.rect.height());
+
+    self.view = QGraphicsView(self.scene)
+    self.view.setDragMode(QGraphicsView.ScrollHandDrag)
+    self.view.setCacheMode(QGraphicsView.CacheBackground)
+    self.view.resize(800, 600);
+
+    if openGL:
+      # Set up the view to use OpenGL as a rendering engine. OpenGL viewports
+      # can not repaint just a part of themselves, so each frame repaints the
+      # whole window, which only pays off when very many objects move
+      viewport = QOpenGLWidget()
+      surfaceFormat = QSurfaceFormat()
+      surfaceFormat.setSamples(4)
+      viewport.setFormat(surfaceFormat)
+
+      self.view.setViewport(viewport)
+      self.view.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+    else:
+      # Only repaint the areas of the items which have changed
+      self.view.setViewportUpdateMode(QGraphicsView.MinimalViewportUpdate)
+
+    # Keys to change the time scale
+    QShortcut(QKeySequence(Qt.Key_Plus), self.view, self.faster)
+    QShortcut(QKeySequence(Qt.Key_Equal), self.view, self.faster)
+    QShortcut(QKeySequence(Qt.Key_Minus), self.view, self.slower)
+
+    # Overlay showing the profile of the world when it has a Profiler,
+    # toggled with P and refreshed a few times a second
+    self._profileOverlay = QLabel(self.view)
+    self._profileOverlay.setFont(QFont('Monospace', 9))
+    self._profileOverlay.setStyleSheet('background-color: rgba(255, 255, 255, 200); padding: 4px')
+    self._profileOverlay.hide()
+    self._profileShown = 0
+    QShortcut(QKeySequence(Qt.Key_P), self.view, self.toggleProfile)
+
+    # Graphics items and speech bubbles of the world objects
+    self._items = {}
+    self._speechBubbles = {}
+
+    # Latest message said by each monster since the last frame
+    self._pendingSpeech = {}
+
+    # Objects which are in the middle of an animation
+    self._animating = set()
+
+    # Cells shown in the window, with a margin, as a tuple (left, top, right,
+    # bottom), or None to show everything. Graphics items are only created
+    # for the objects in them
+    self._visibleCells = None
+
+    for obj in world.objects():
+      self.objectAdded(obj)
+
+    world.addObserver(self)
+
+    # Timer advancing the simulation and the animations
+    self._frameTimer = QTimer()
+    self._frameTimer.setInterval(World.tickLength)
+    self._frameTimer.timeout.connect(self._frame)
+    self._lastFrame = None
+
+    self.setTimeScale(1)
+
+  def exec_(self):
+    ''' Shows the window and runs the simulation until it is closed '''
+    self.view.show()
+    self._lastFrame = time.time()
+    self._frameTimer.start()
+    result = self._app.exec()
+    self._frameTimer.stop()
+    return result
+
+  def setTimeScale(self, timeScale):
+    ''' Runs the world timeScale times faster than real time, or as fast as
+        possible if timeScale is None '''
+    self._timeScale = timeScale
+
+    if timeScale is None:
+      self.view.setWindowTitle('Monsters (fast forward)')
+    else:
+      self.view.setWindowTitle('Monsters (%gx)' % timeScale)
+
+  def faster(self):
+    if self._timeScale in self.timeScales:
+      index = self.timeScales.index(self._timeScale)
+      self.setTimeScale(self.timeScales[min(index + 1, len(self.timeScales) - 1)])
+
+  def slower(self):
+    if self._timeScale in self.timeScales:
+      index = self.timeScales.index(self._timeScale)
+      self.setTimeScale(self.timeScales[max(index - 1, 0)])
+
+  def toggleProfile(self):
+    ''' Shows or hides the overlay with the profile of the world '''
+    self._profileOverlay.setVisible(not self._profileOverlay.isVisible())
+    self._profileShown = 0
+
+  def _updateProfile(self):
+    profiler = self._world._profiler
+
+    if self._profileOverlay.isVisible() and time.time() - self._profileShown > 0.5:
+      self._profileShown = time.time()
+      self._profileOverlay.setText(profiler.summary() if profiler is not None else 'No profiler attached')
+      self._profileOverlay.adjustSize()
+
+  def _frame(self):
+    ''' Advances the world by the real time passed since the last frame, scaled
+        by the time scale, and brings the animations up to date '''
+    now = time.time()
+    # Don't try to catch up after the window was blocked, e.g. while dragged
+    elapsed = min((now - self._lastFrame) * 1000, 100)
+    self._lastFrame = now
+
+    if self._timeScale is None:
+      while (time.time() - now) * 1000 < self.unlimitedFrameBudget:
+        self._world.advance(World.tickLength * 10)
+    else:
+      self._world.advance(elapsed * self._timeScale)
+
+    self._updateVisibleCells()
+
+    for obj in list(self._animating):
+      self._updateItem(obj)
+
+    self._showSpeech()
+    self._updateProfile()
+
+  def _updateVisibleCells(self):
+    ''' Creates and removes graphics items after the window was scrolled or resized '''
+    area = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+    visibleCells = (int(area.left() // self.cellSize) - 1, int(area.top() // self.cellSize) - 1,
+                    int(area.right() // self.cellSize) + 1, int(area.bottom() // self.cellSize) + 1)
+
+    if visibleCells != self._visibleCells:
+      self._visibleCells = visibleCells
+
+      for obj in self._world.objects():
+        self._updateItem(obj)
+
+  def _isVisible(self, obj):
+    if self._visibleCells is None:
+      return True
+
+    left, top, right, bottom = self._visibleCells
+    positions = [obj._pos]
+
+    if isinstance(obj, Monster) and obj._targetPos is not None:
+      positions.append(obj._targetPos)
+
+    return any(left <= pos.x() <= right and top <= pos.y() <= bottom for pos in positions)
+
+  def _createItem(self, obj):
+    graphicsItem = QGraphicsPixmapItem(SpriteCache.pixmap(obj._image, self.cellSize))
+    graphicsItem.setTransformOriginPoint(graphicsItem.boundingRect().center())
+    graphicsItem.setZValue(obj._z)
+
+    self._items[obj] = graphicsItem
+    self.scene.addItem(graphicsItem)
+
+    return graphicsItem
+
+  def _removeItem(self, obj):
+    graphicsItem = self._items.pop(obj, None)
+
+    if graphicsItem != None:
+      self.scene.removeItem(graphicsItem)
+
+    speechBubble = self._speechBubbles.pop(obj, None)
+
+    if speechBubble != None:
+      speechBubble.remove()
+
+  def objectAdded(self, obj):
+    self._updateItem(obj)
+
+  def objectRemoved(self, obj):
+    self._animating.discard(obj)
+    self._pendingSpeech.pop(obj, None)
+    self._removeItem(obj)
+
+  def objectChanged(self, obj):
+    self._updateItem(obj)
+
+  def terrainChanged(self, pos):
+    self.scene.terrainChanged(pos)
+
+  def _progress(self, start, length):
+    ''' Returns how far, between 0.0 and 1.0, an animation has got '''
+    if length <= 0:
+      return 1.0
+
+    return min(float(self._world.time() - start) / length, 1.0)
+
+  def _updateItem(self, obj):
+    ''' Shows the object as it is at the current simulation time '''
+    if not self._isVisible(obj):
+      self._removeItem(obj)
+      self._animating.discard(obj)
+      return
+
+    graphicsItem = self._items.get(obj)
+
+    if graphicsItem is None:
+      graphicsItem = self._createItem(obj)
+
+    x, y = obj._pos.x(), obj._pos.y()
+    scale, opacity, rotation = 1.0, 1.0, 0
+    animating = False
+
+    if isinstance(obj, Monster) and obj._targetPos is not None:
+      # Interpolate between the cells while the monster is moving
+      t = self._progress(obj._moveStart, obj._moveLength)
+      x += (obj._targetPos.x() - x) * t
+      y += (obj._targetPos.y() - y) * t
+
+      # Arrange for the monster to wobble as it moves
+      step = int(t * 4 * self._wobbleFrames)
+      rotation = step % self._wobbleFrames + 1
+      if (step // self._wobbleFrames) % 2 == 1:
+        rotation = -rotation
+
+      animating = True
+    elif isinstance(obj, PickableWorldObject):
+      if obj._animation is not None:
+        t = self._progress(obj._animationStart, PickableWorldObject._animationDuration)
+
+        if obj._animation == PickableWorldObject.Appearing:
+          scale = opacity = max(t, 0.1)
+        else:
+          scale = opacity = 1.0 - t
+
+        animating = True
+      elif obj._isVanished:
+        opacity = 0.0
+
+    graphicsItem.setPos(x * self.cellSize, y * self.cellSize)
+    graphicsItem.setScale(scale)
+    graphicsItem.setOpacity(opacity)
+    graphicsItem.setRotation(rotation)
+
+    if animating:
+      self._animating.add(obj)
+    else:
+      self._animating.discard(obj)
+
+    if obj in self._speechBubbles:
+      self._updateSpeechBubblePos(obj)
+
+  def monsterSaid(self, monster, message, seconds):
+    # Only the last message said during a frame could be seen, so the bubbles
+    # are updated once the frame is over
+    self._pendingSpeech[monster] = (message, seconds)
+
+  def _showSpeech(self):
+    for monster, (message, seconds) in self._pendingSpeech.items():
+      if not monster in self._items:
+        # Nobody can see the monster, so nobody would see the bubble
+        continue
+
+      if not monster in self._speechBubbles:
+        self._speechBubbles[monster] = SpeechBubble(self.scene)
+
+      speechBubble = self._speechBubbles[monster]
+      speechBubble.setMessage(message)
+      self._updateSpeechBubblePos(monster)
+      speechBubble.show(seconds)
+
+    self._pendingSpeech = {}
+
+  def _updateSpeechBubblePos(self, monster):
+    ''' Update speech bubble position so it is right above the monster '''
+    graphicsItem = self._items[monster]
+
+    monsterWidth = graphicsItem.boundingRect().width()
+    monsterX = graphicsItem.x()
+    monsterY = graphicsItem.y()
+
+    self._speechBubbles[monster].setPos(monsterX + monsterWidth / 2, monsterY);
+
+class SpeechBubble:
+  textMargin = 10
+
+  arrowWidth = 10
+  arrowHeight = 10
+  arrowPosition = 40
+
+  # Maximum number of drawn bubbles kept for reuse
+  cacheSize = 64
+
+  # Drawn bubble pixmaps shared by all bubbles, by (message, font key), least
+  # recently used first. Monsters say the same few things over and over
+  _pixmapCache = OrderedDict()
+
+  def __init__(self, scene):
+    self._scene = scene
+
+    # Font used
+    self._font = QFont("arial", 10)
+    # Font metrics for determining the size of the message
+    self._fm = QFontMetrics(self._font)
+
+    # Timer to hide bubble after some time
+    self._hideTimer = QTimer()
+    self._hideTimer.setSingleShot(True)
+    self._hideTimer.timeout.connect(self.hide)
+
+    # Create graphics item for the bubble
+    self._graphicsItem = QGraphicsPixmapItem()
+    self._graphicsItem.setZValue(100)
+
+    self._scene.addItem(self._graphicsItem)
+
+  def setMessage(self, message):
+    # Crop the string to the allowed length
+    message = message[:140]
+
+    key = (message, self._font.key())
+    bubble = SpeechBubble._pixmapCache.pop(key, None)
+
+    if bubble is None:
+      bubble = self._drawBubble(message)
+
+      if len(SpeechBubble._pixmapCache) >= SpeechBubble.cacheSize:
+        SpeechBubble._pixmapCache.popitem(last = False)
+
+    SpeechBubble._pixmapCache[key] = bubble
+
+    self._graphicsItem.setPixmap(bubble)
+
+  def _drawBubble(self, message):
+    ''' Returns a new pixmap with a bubble containing the message '''
+    # Determine the size of message
+    textWidth = self._fm.horizontalAdvance(message)
+    textHeight = self._fm.height()
+
+    # If message is long, split it into two lines
+    if len(message) > 70:
+      bubbleWidth = self._fm.horizontalAdvance(message[:70]) + SpeechBubble.textMargin * 2
+      bubbleHeight = self._fm.height() * 2 + SpeechBubble.textMargin * 2
+    else:
+      bubbleWidth = textWidth + SpeechBubble.textMargin * 2
+      bubbleHeight = textHeight + SpeechBubble.textMargin * 2
+
+    # Create pixmap to draw on
+    bubble = QPixmap(bubbleWidth, bubbleHeight + SpeechBubble.arrowHeight)
+    bubble.fill(Qt.transparent)
+
+    bubblPath = QPainterPath()
+    # Create bubble box
+    bubblPath.addRoundedRect(QRectF(1,1,bubbleWidth - 2,bubbleHeight - 2), 10, 30, Qt.RelativeSize)
+    # Create arrow
+    bubblPath.moveTo(QPointF(SpeechBubble.arrowPosition, bubbleHeight - 1))
+    bubblPath.lineTo(QPointF(SpeechBubble.arrowPosition + SpeechBubble.arrowWidth / 2,
+                              bubbleHeight + SpeechBubble.arrowHeight))
+    bubblPath.lineTo(QPointF(SpeechBubble.arrowPosition + SpeechBubble.arrowWidth, bubbleHeight - 1))
+    # Merge arrow with bubble box
+    bubblPath = bubblPath.simplified()
+
+    # Draw bubble
+    bubblePainter = QPainter(bubble)
+    bubblePainter.setRenderHint(QPainter.Antialiasing)
+    bubblePainter.setBrush(QBrush(Qt.white))
+    bubblePainter.setPen(Qt.black)
+    bubblePainter.setOpacity(0.7)
+    bubblePainter.drawPath(bubblPath)
+
+    # Draw text on bubble
+    bubblePainter.setRenderHint(QPainter.TextAntialiasing)
+    bubblePainter.setOpacity(1)
+    bubblePainter.setFont(self._font)
+    bubblePainter.drawText(QRectF(self.textMargin, self.textMargin, bubbleWidth, bubbleHeight),
+                           Qt.TextWordWrap | Qt.AlignTop, message)
+
+    del bubblePainter
+
+    return bubble
+
+  def setPos(self, x, y):
+    ''' Set the position of this speech bubble in that way that x and y are the coords of
+        the arrow '''
+    newX = x - SpeechBubble.arrowPosition - SpeechBubble.arrowWidth / 2
+    newY = y - self._graphicsItem.boundingRect().height() - SpeechBubble.arrowHeight
+
+    self._graphicsItem.setPos(newX, newY);
+
+  def show(self, seconds = None):
+    ''' Show the bubble for specified number of seconds, or forever if seconds is None '''
+    if seconds != None:
+      # Start a timer to hide the bubble after specified time
+      self._hideTimer.start(int(seconds * 1000))
+
+    self._graphicsItem.show()
+
+  def hide(self):
+    self._graphicsItem.hide()
+
+  def remove(self):
+    self._hideTimer.stop()
+    self._scene.removeItem(self._graphicsItem)
@@ -0,0 +1,380 @@
+''' Running the decision logic of monsters in other processes, so a slow or
+    stuck monster can not hold up the world, and expensive monsters use all
+    the processor cores.
+
+    The logic of such a monster is a Brain. On each turn it gets an
+    Observation of what the monster can see and returns a list of actions:
+
+      class GreedyBrain(Brain):
+        def decide(self, observation):
+          return [('eat',), ('move', World.East)]
+
+      class Greedy(RemoteMonster):
+        brainClass = GreedyBrain
+
+    Brains must be defined at the top level of a module, so that the worker
+    processes can import them. Without a WorkerPool a RemoteMonster runs its
+    brain in-process like any other monster. With one,
+
+      pool = WorkerPool(world, processes = 4, deadline = 0.05)
+      world.run(6000)
+      pool.close()
+
+    the brains of all the monsters due for a turn at the same time think in
+    parallel. A monster whose brain has not answered within the deadline
+    misses the turn, and the other monsters of its worker move to other
+    workers. Whether a brain misses the deadline depends on the wall time it
+    takes, so a run in which brains miss it may play out differently each
+    time.
+'''
+
+import logging, multiprocessing, time, traceback
+
+from multiprocessing.connection import wait
+
+from monsters import World, Monster
+
+logger = logging.getLogger('monsters')
+
+# Directions in the order of Observation.surroundings
+directions = [World.North, World.South, World.East, World.West]
+
+class Observation(object):
+  ''' What a monster knows on its turn. Sent to the workers as a plain tuple '''
+
+  __slots__ = ('pos', 'energy', 'surroundings', 'fruits', 'hasRing', 'worldSize')
+
+  def __init__(self, pos, energy, surroundings, fruits, hasRing, worldSize):
+    # Position of the monster as a tuple (x, y)
+    self.pos = pos
+    self.energy = energy
+
+    # What Monster.observe() returns in each of the directions, in the order
+    # North, South, East, West
+    self.surroundings = surroundings
+
+    # Fruits monster can smell, as tuples (x, y, type)
+    self.fruits = fruits
+
+    # Whether monster has the rubber ring and can swim
+    self.hasRing = hasRing
+
+    # Width and height of the world
+    self.worldSize = worldSize
+
+  def toTuple(self):
+    return (self.pos, self.energy, self.surroundings, self.fruits, self.hasRing, self.worldSize)
+
+  def canMove(self, direction):
+    ''' Returns True if monster could move in the specified direction, unless
+        another monster gets there first '''
+    seen = self.surroundings[directions.index(direction)]
+    return seen in (World.Grass, World.Fruit, World.Item) or (seen == World.Pond and self.hasRing)
+
+class Brain(object):
+  ''' Decision logic of a RemoteMonster. Each monster gets an instance of its
+      own, which lives in a worker process, so it can keep what it learns in
+      its attributes '''
+
+  def decide(self, observation):
+    ''' Returns the list of actions to take for the Observation. Actions are
+        tuples ('eat',), ('pick',), ('move', direction) or ('say', message),
+        taken in order. To be implemented by monster creators '''
+    return []
+
+class RemoteMonster(Monster):
+  ''' A monster whose behaviour is decided by a Brain, which a WorkerPool may
+      run in another process '''
+
+  # Subclass of Brain deciding what the monster does
+  brainClass = Brain
+
+  def observation(self):
+    ''' Returns the Observation for the current turn '''
+    senses = self.sense()
+
+    return Observation((senses.pos._x, senses.pos._y), senses.energy,
+                       tuple(senses.surroundings[direction] for direction in directions),
+                       tuple((pos._x, pos._y, fruitType) for pos, fruitType in senses.smell),
+                       self._world.rubberRing in senses.items,
+                       (self._world.width, self._world.height))
+
+  def behaviour(self):
+    # Without a WorkerPool, think in this process
+    if not '_brain' in self.__dict__:
+      self._brain = self.brainClass()
+
+    self._act(self._brain.decide(self.observation()))
+
+  def _act(self, actions):
+    ''' Takes the actions a brain decided on '''
+    for action in actions or ():
+      if action[0] == 'eat':
+        if self.isOnFruit():
+          self.eatFruit()
+      elif action[0] == 'pick':
+        self.pickItem()
+      elif action[0] == 'move':
+        self.move(action[1])
+      elif action[0] == 'say':
+        self.say(action[1])
+      else:
+        logger.warning('%s %d: unknown action %r', type(self).__name__, self._index, action)
+
+    if self._targetPos is None and not self._isSleeping and not self._turnPending:
+      # Did not move, so think again after a while
+      self._missTurn()
+
+def _work(connection):
+  ''' Main function of a worker process. Receives batches of (monster index,
+      brain class, observation tuple, whether to start a new brain), and sends
+      back (batch, monster index, actions) for each as soon as it is decided,
+      then (batch, None, None) '''
+  brains = {}
+
+  while True:
+    message = connection.recv()
+
+    if message is None:
+      break
+
+    batch, requests = message
+
+    for index, brainClass, observation, newBrain in requests:
+      brain = brains.get(index)
+
+      if newBrain or brain is None or type(brain) is not brainClass:
+        brain = brains[index] = brainClass()
+
+      try:
+        actions = brain.decide(Observation(*observation))
+      except Exception:
+        traceback.print_exc()
+        actions = []
+
+      connection.send((batch, index, actions))
+
+    connection.send((batch, None, None))
+
+class WorkerPool(object):
+  ''' Worker processes running the brains of the RemoteMonsters of a world.
+      Each monster goes to the same worker, which keeps its brain, until that
+      worker misses the deadline. Then the other monsters of the worker move
+      to the workers with the fewest monsters, starting with new brains, and
+      leave it to the monster it is stuck on, which is sent last from then
+      on. A worker which has not answered for restartTime seconds is
+      restarted, losing the brains it kept '''
+
+  def __init__(self, world, processes = None, deadline = 0.1):
+    self._world = world
+
+    # Wall time in seconds a batch of brains may take to answer
+    self.deadline = deadline
+
+    # Wall time in seconds after which a worker which still has not answered
+    # is restarted, losing the brains it kept
+    self.restartTime = max(deadline * 20, 1.0)
+
+    self._connections = []
+    self._processes = []
+
+    # Number of the worker of each monster, by index, and the indices of the
+    # monsters which start a new brain on their next request
+    self._assignments = {}
+    self._newBrains = set()
+
+    for number in range(processes or multiprocessing.cpu_count()):
+      self._connections.append(None)
+      self._processes.append(None)
+      self._startWorker(number)
+
+    # Workers which have not finished the batch sent to them yet, with the
+    # time it was sent and the indices of the monsters not answered yet
+    self._busy = {}
+
+    self._batch = 0
+
+    # Turns missed by each monster because its brain did not answer in time,
+    # and the number of times a worker missed the deadline on its brain, by
+    # index
+    self.missedTurns = {}
+    self.hangs = {}
+
+    world._workers = self
+
+  def _startWorker(self, number):
+    connection, workerConnection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target = _work, args = (workerConnection,))
+    process.daemon = True
+    process.start()
+
+    self._connections[number] = connection
+    self._processes[number] = process
+
+  def close(self):
+    ''' Stops the worker processes and lets the world think in-process again '''
+    if self._world._workers is self:
+      self._world._workers = None
+
+    for connection, process in zip(self._connections, self._processes):
+      if connection in self._busy:
+        process.terminate()
+      else:
+        connection.send(None)
+
+      process.join()
+
+  def runTurns(self, monsters):
+    ''' Runs the behaviour turns of the monsters, given in the order the
+        scheduler chose. Remote brains think at the same time from
+        observations made before any of the monsters act, and then all the
+        actions are taken in that order, so when two monsters go for the same
+        cell the first one gets it '''
+    self._batch += 1
+
+    requests = dict((connection, []) for connection in self._connections)
+
+    for monster in monsters:
+      if isinstance(monster, RemoteMonster):
+        connection = self._connections[self._workerOf(monster._index)]
+
+        if not connection in self._busy:
+          newBrain = monster._index in self._newBrains
+          self._newBrains.discard(monster._index)
+
+          requests[connection].append((monster._index, monster.brainClass, monster.observation().toTuple(),
+                                       newBrain))
+
+    waiting = []
+
+    for connection, batch in requests.items():
+      if len(batch) != 0:
+        batch.sort(key = lambda request: self.hangs.get(request[0], 0))
+        connection.send((self._batch, batch))
+        self._busy[connection] = (time.time(), [request[0] for request in batch])
+        waiting.append(connection)
+
+    actions = {}
+    deadline = time.time() + self.deadline
+
+    # Only the workers sent this batch are waited for, not the ones still
+    # stuck on earlier batches
+    while len(waiting) != 0 and time.time() < deadline:
+      for connection in wait(waiting, max(deadline - time.time(), 0)):
+        self._receive(connection, actions)
+
+      waiting = [connection for connection in waiting if connection in self._busy]
+
+    for monster in monsters:
+      if not isinstance(monster, RemoteMonster):
+        monster._takeTurn()
+        continue
+
+      monster._turnPending = False
+
+      if monster._index in actions:
+        monster._act(actions[monster._index])
+      else:
+        self.missedTurns[monster] = self.missedTurns.get(monster, 0) + 1
+        monster._missTurn()
+
+    # Collect the answers which came after the deadline
+    for connection in wait(list(self._busy), 0):
+      while connection in self._busy and connection.poll():
+        self._receive(connection, {})
+
+    # Workers sent this batch which missed the deadline are stuck on the
+    # first monster they have not answered yet, unless only the end of the
+    # batch came late
+    for connection, (sent, indices) in self._busy.items():
+      if len(requests[connection]) != 0 and len(indices) != 0:
+        self.hangs[indices[0]] = self.hangs.get(indices[0], 0) + 1
+        self._moveMonstersAway(self._connections.index(connection), indices[0])
+
+    for connection, (sent, indices) in list(self._busy.items()):
+      if len(indices) != 0 and time.time() - sent > self.restartTime:
+        number = self._connections.index(connection)
+        logger.warning('Worker %d has been stuck on monster %d for %.1f s, restarting it',
+                       number, indices[0], time.time() - sent)
+
+        del self._busy[connection]
+        self._processes[number].terminate()
+        self._processes[number].join()
+        self._startWorker(number)
+
+  def _workerOf(self, index):
+    ''' Returns the number of the worker of a monster, giving a new monster
+        to the worker with the fewest monsters '''
+    number = self._assignments.get(index)
+
+    if number is None:
+      counts = [0] * len(self._connections)
+      for assigned in self._assignments.values():
+        counts[assigned] += 1
+
+      number = self._assignments[index] = counts.index(min(counts))
+
+    return number
+
+  def _moveMonstersAway(self, number, stuckIndex):
+    ''' Moves the monsters of a worker which missed the deadline, but for the
+        one it is stuck on, to the workers which are not busy with the fewest
+        monsters. Nothing moves if every worker is busy '''
+    free = [other for other, connection in enumerate(self._connections)
+            if other != number and not connection in self._busy]
+
+    if len(free) == 0:
+      return
+
+    counts = dict((other, 0) for other in free)
+    for assigned in self._assignments.values():
+      if assigned in counts:
+        counts[assigned] += 1
+
+    for index, assigned in sorted(self._assignments.items()):
+      if assigned == number and index != stuckIndex:
+        other = min(free, key = lambda other: (counts[other], other))
+        counts[other] += 1
+
+        self._assignments[index] = other
+        self._newBrains.add(index)
+
+  def _receive(self, connection, actions):
+    ''' Reads an answer of a worker. Answers to earlier batches came too late
+        and are dropped '''
+    batch, index, result = connection.recv()
+
+    if index is None:
+      del self._busy[connection]
+      return
+
+    self._busy[connection][1].remove(index)
+
+    if batch == self._batch:
+      actions[index] = result
+
+class GreedyBrain(Brain):
+  ''' Brain of GreedyMonster: eats and picks up what it finds, and heads for
+      the nearest fruit it can smell, like DefaultMonster '''
+
+  def decide(self, observation):
+    actions = [('eat',), ('pick',)]
+    x, y = observation.pos
+
+    steps = []
+    if len(observation.fruits) != 0:
+      fruitX, fruitY, fruitType = min(observation.fruits, key = lambda fruit: abs(fruit[0] - x) + abs(fruit[1] - y))
+      steps = [(fruitX > x, World.East), (fruitX < x, World.West), (fruitY < y, World.North), (fruitY > y, World.South)]
+
+    for wanted, direction in steps:
+      if wanted and observation.canMove(direction):
+        return actions + [('move', direction)]
+
+    possible = [direction for direction in directions if observation.canMove(direction)]
+    if len(possible) != 0:
+      actions.append(('move', possible[(x * 7 + y * 13) % len(possible)]))
+
+    return actions
+
+class GreedyMonster(RemoteMonster):
+  brainClass = GreedyBrain
@@ -0,0 +1,336 @@
+''' Reading world files, and compiling them into a binary format which loads
+    in a fraction of the time.
+
+    A text world file has one line per row of cells, one character per cell:
+
+      .  grass
+      #  rock
+      ~  pond
+      *  source of gems
+
+    A compiled world file starts with a header (see headerFormat) followed by
+    three arrays of width * height bytes, each stored row by row:
+
+      terrain     the terrain type of each cell in the low 4 bits, and for
+                  rocks the image to show, 1 to 4, in the high 4 bits
+      passability Walkable and Swimmable bits for each cell
+      neighbours  for each cell, bit 1 << direction is set in the low 4 bits
+                  if a monster can walk from that cell in that direction, and
+                  in the high 4 bits if it can swim that way
+
+    The arrays are stored uncompressed, so the file can be memory mapped.
+
+    To compile a world:
+
+      python worldfile.py compile-world worlds/1.world worlds/1.mworld
+'''
+
+import mmap, struct
+
+from collections import OrderedDict
+
+# Magic bytes and version at the start of a compiled world file
+magic = b'MWLD'
+version = 1
+
+# Header: magic, version, reserved, width, height
+headerFormat = '<4sHHII'
+headerSize = struct.calcsize(headerFormat)
+
+# Terrain types of the cells
+Grass, Rock, Pond, GemSource = range(4)
+
+# Characters of the terrain types in text world files
+terrainCharacters = {'.' : Grass, '#' : Rock, '~' : Pond, '*' : GemSource}
+
+# Bits of the passability array
+Walkable, Swimmable = 1, 2
+
+# Tables for bytes.translate() from text world characters to terrain types,
+# and from terrain types to passability bits
+_characterTable = bytes(terrainCharacters.get(chr(char), 0) for char in range(256))
+_passabilityTable = bytes({Grass : Walkable | Swimmable, Rock : 0, Pond : Swimmable,
+                           GemSource : Walkable | Swimmable}.get(value & 0x0f, 0) for value in range(256))
+
+class WorldData(object):
+  ''' Terrain of a world as loaded from a file: its width and height, and the
+      terrain, passability and neighbours arrays described above '''
+
+  def __init__(self, width, height, terrain, passability = None, neighbours = None):
+    self.width = width
+    self.height = height
+    self.terrain = terrain
+
+    if passability is None or neighbours is None:
+      passability, neighbours = computeMasks(width, height, terrain)
+
+    self.passability = passability
+    self.neighbours = neighbours
+
+  def blocks(self, array, blockSize = 1 << 20):
+    ''' Yields (index of the first cell, bytes) for consecutive blocks of
+        one of the arrays, so a large mapped file can be scanned without
+        copying it whole '''
+    for start in range(0, len(array), blockSize):
+      yield start, bytes(array[start : start + blockSize])
+
+class ChunkedArray(object):
+  ''' Array of one byte per cell of a world, indexed by y * width + x just
+      like a bytearray, but kept in square chunks of cells which are copied
+      from a source array, e.g. a memory mapped world file, when first used.
+      Once more than maxChunks chunks are loaded, the least recently used
+      ones are dropped again, unless they were changed '''
+
+  def __init__(self, width, height, source, table = None, chunkSize = 64, maxChunks = 1024):
+    self._width = width
+    self._height = height
+    self._source = source
+
+    # Table for bytes.translate() applied to the cells copied from the source
+    self._table = table
+
+    # Chunks are chunkSize x chunkSize cells, chunkSize being a power of two
+    self._shift = chunkSize.bit_length() - 1
+    self._chunkSize = 1 << self._shift
+    self._mask = self._chunkSize - 1
+    self._maxChunks = maxChunks
+
+    # Loaded chunks by (chunk x, chunk y), least recently used first, and
+    # the keys of the ones which have been written to
+    self._chunks = OrderedDict()
+    self._dirty = set()
+
+    # The chunk used last, which is most likely to be used next
+    self._lastKey = None
+    self._lastChunk = None
+
+  def __len__(self):
+    return self._width * self._height
+
+  def __iter__(self):
+    for index in range(len(self)):
+      yield self[index]
+
+  def __getitem__(self, index):
+    y, x = divmod(index, self._width)
+    return self._chunk(x, y)[(y & self._mask) << self._shift | (x & self._mask)]
+
+  def __setitem__(self, index, value):
+    y, x = divmod(index, self._width)
+    chunk = self._chunk(x, y)
+    chunk[(y & self._mask) << self._shift | (x & self._mask)] = value
+    self._dirty.add(self._lastKey)
+
+  def __copy__(self):
+    ''' Returns a copy with the same source and copies of the loaded chunks '''
+    array = ChunkedArray.__new__(ChunkedArray)
+    array.__dict__.update(self.__dict__)
+    array._chunks = OrderedDict((key, bytearray(chunk)) for key, chunk in self._chunks.items())
+    array._dirty = set(self._dirty)
+    array._lastKey = None
+    array._lastChunk = None
+    return array
+
+  def loadedChunks(self):
+    ''' Returns the number of chunks in memory '''
+    return len(self._chunks)
+
+  def _chunk(self, x, y):
+    key = (x >> self._shift, y >> self._shift)
+
+    if key == self._lastKey:
+      return self._lastChunk
+
+    chunk = self._chunks.get(key)
+
+    if chunk is None:
+      chunk = self._read(key)
+      self._chunks[key] = chunk
+      self._evict()
+    else:
+      self._chunks.move_to_end(key)
+
+    self._lastKey = key
+    self._lastChunk = chunk
+    return chunk
+
+  def _read(self, key):
+    ''' Returns a new chunk copied from the source '''
+    left, top = key[0] << self._shift, key[1] << self._shift
+    width = min(self._chunkSize, self._width - left)
+    chunk = bytearray(self._chunkSize * self._chunkSize)
+
+    for row in range(min(self._chunkSize, self._height - top)):
+      start = (top + row) * self._width + left
+      chunk[row << self._shift : (row << self._shift) + width] = \
+        bytes(self._source[start : start + width]).translate(self._table)
+
+    return chunk
+
+  def _evict(self):
+    # Every chunk but the one just loaded is looked at once at most, as
+    # changed ones go to the back
+    for attempt in range(len(self._chunks) - 1):
+      if len(self._chunks) <= self._maxChunks:
+        break
+
+      key, chunk = self._chunks.popitem(last = False)
+
+      if key in self._dirty:
+        if chunk != self._read(key):
+          # Holds changes, e.g. monsters or fruits, which would be lost
+          self._chunks[key] = chunk
+          continue
+
+        self._dirty.discard(key)
+
+      if key == self._lastKey:
+        self._lastKey = None
+        self._lastChunk = None
+
+def rockType(x, y):
+  ''' Returns the image, 1 to 4, to show for a rock in the cell at x, y. It
+      is a hash of the position, so the same map always looks the same '''
+  return ((x * 73856093) ^ (y * 19349663)) % 4 + 1
+
+def parseWorld(lines, filename = '<world>'):
+  ''' Returns WorldData of a text world given as a list of lines. Raises a
+      ValueError if the rows differ in length or contain unknown characters '''
+  rows = [line.rstrip('\r\n') for line in lines]
+
+  # Ignore empty lines at the end of the file
+  while len(rows) != 0 and rows[-1] == '':
+    rows.pop()
+
+  if len(rows) == 0:
+    raise ValueError('%s: the world is empty' % filename)
+
+  width, height = len(rows[0]), len(rows)
+
+  for y in range(height):
+    if len(rows[y]) != width:
+      raise ValueError('%s:%d: row is %d cells long, expected %d' % (filename, y + 1, len(rows[y]), width))
+
+    unknown = set(rows[y]).difference(terrainCharacters)
+    if len(unknown) != 0:
+      x = min(rows[y].index(char) for char in unknown)
+      raise ValueError('%s:%d:%d: unknown character %r' % (filename, y + 1, x + 1, rows[y][x]))
+
+  terrain = bytearray(''.join(rows).encode('ascii').translate(_characterTable))
+
+  # Give every rock its image
+  index = terrain.find(Rock)
+  while index != -1:
+    terrain[index] = Rock | rockType(index % width, index // width) << 4
+    index = terrain.find(Rock, index + 1)
+
+  return WorldData(width, height, terrain)
+
+def computeMasks(width, height, terrain):
+  ''' Returns the passability and neighbours arrays for the terrain. Rather
+      than cell by cell, whole rows of cells are shifted and combined as big
+      integers, so this takes a moment even for millions of cells '''
+  count = width * height
+  passability = bytes(terrain).translate(_passabilityTable)
+
+  # Cells which have a neighbour to the east and to the west
+  notLastColumn = _toInt((b'\x01' * (width - 1) + b'\x00') * height)
+  notFirstColumn = _toInt((b'\x00' + b'\x01' * (width - 1)) * height)
+
+  neighbours = 0
+
+  for bit, shift in [(Walkable, 0), (Swimmable, 4)]:
+    layer = _toInt(passability.translate(bytes((value & bit) and 1 for value in range(256))))
+
+    # Byte i of the integer is cell i, so shifting by a row moves every cell
+    # onto the cell below or above it
+    neighbours |= (layer << 8 * width) << shift
+    neighbours |= (layer >> 8 * width) << (shift + 1)
+    neighbours |= ((layer >> 8) & notLastColumn) << (shift + 2)
+    neighbours |= ((layer << 8) & notFirstColumn) << (shift + 3)
+
+  mask = (1 << 8 * count) - 1
+  return bytearray(passability), bytearray((neighbours & mask).to_bytes(count, 'little'))
+
+def _toInt(cells):
+  return int.from_bytes(cells, 'little')
+
+def writeCompiled(data, filename):
+  ''' Writes WorldData into a compiled world file '''
+  outputFile = open(filename, 'wb')
+  try:
+    outputFile.write(struct.pack(headerFormat, magic, version, 0, data.width, data.height))
+    outputFile.write(bytes(data.terrain))
+    outputFile.write(bytes(data.passability))
+    outputFile.write(bytes(data.neighbours))
+  finally:
+    outputFile.close()
+
+def readCompiled(filename):
+  ''' Returns WorldData of a compiled world file. The arrays are views of
+      the memory mapped file '''
+  worldFile = open(filename, 'rb')
+  try:
+    fileMap = mmap.mmap(worldFile.fileno(), 0, access = mmap.ACCESS_READ)
+  finally:
+    worldFile.close()
+
+  fileMagic, fileVersion, reserved, width, height = struct.unpack(headerFormat, fileMap[:headerSize])
+
+  if fileMagic != magic or fileVersion != version:
+    raise ValueError('%s: not a compiled world file of version %d' % (filename, version))
+
+  cellCount = width * height
+  if len(fileMap) != headerSize + cellCount * 3:
+    raise ValueError('%s: the file is truncated' % filename)
+
+  view = memoryview(fileMap)
+  return WorldData(width, height,
+                   view[headerSize : headerSize + cellCount],
+                   view[headerSize + cellCount : headerSize + cellCount * 2],
+                   view[headerSize + cellCount * 2 : headerSize + cellCount * 3])
+
+def isCompiled(filename):
+  worldFile = open(filename, 'rb')
+  try:
+    return worldFile.read(len(magic)) == magic
+  finally:
+    worldFile.close()
+
+def load(filename):
+  ''' Returns WorldData of a text or compiled world file '''
+  if isCompiled(filename):
+    return readCompiled(filename)
+
+  worldFile = open(filename, 'r')
+  try:
+    return parseWorld(worldFile.readlines(), filename)
+  finally:
+    worldFile.close()
+
+def compileWorld(source, destination):
+  ''' Compiles the world file source into destination '''
+  writeCompiled(load(source), destination)
+
+if __name__ == '__main__':
+  # Only needed here, and slow to import for everything using world files
+  import argparse
+
+  parser = argparse.ArgumentParser(description = 'Tools for world files.')
+  commands = parser.add_subparsers(dest = 'command')
+
+  compileCommand = commands.add_parser('compile-world', help = 'compile a text world into the binary format')
+  compileCommand.add_argument('source')
+  compileCommand.add_argument('destination', nargs = '?',
+                              help = 'defaults to the source with the extension .mworld')
+
+  args = parser.parse_args()
+
+  if args.command == 'compile-world':
+    destination = args.destination
+    if destination is None:
+      destination = args.source.rsplit('.', 1)[0] + '.mworld'
+
+    compileWorld(args.source, destination)
+  else:
+    parser.print_help()